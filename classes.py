@@ -1,3 +1,4 @@
+from array import array
 from functions import *
 from constants import *
 
@@ -6,67 +7,875 @@ from constants import *
 """
 
 class Grid:
-    __slots__ = ["grid"]
+    __slots__ = ["on"]
     def __init__(self, columns, rows):
-        index = 0
-        grid = []
-        for i in range(columns):
-            column = []
-            for j in range(rows):
-                if j % 4 == 0: index = 0
-                column.append(Cell(correct_index(index, i, CORRECT_INDEX)))
-                index += 1
-            grid.append(tuple(column))
-        self.grid = tuple(grid)
+        self.on = array('H', [0] * columns) # one bit per row, row 0 is the lowest bit
+
+    def bits(self, col):
+        return self.on[col]
+
+    def is_on(self, col, row):
+        return self.on[col] >> row & 1
+
+    def set(self, col, row, is_on=True):
+        if is_on: self.on[col] |= 1 << row
+        else:     self.on[col] &= ~(1 << row)
+
+    def toggle(self, col, row):
+        self.on[col] ^= 1 << row
+
+    def clear(self):
+        r = range(len(self.on))
+        for i in r: self.on[i] = 0
+
+class Measure:
+    __slots__ = ["on", "accent", "events"]
+    def __init__(self, source=None):
+        self.on = array('H', source.on if source else [0] * 8)
+        self.accent = array('H', source.accent if source else [0] * 8)
+        self.events = list(source.events) if source else [b''] * 8 # (channel, note, velocity) that sound on each step
 
 class NoteGrid:
-    __slots__ = ["grid"]
-    def __init__(self, columns, rows, starting_note, send):
-        index = 0
-        grid = []
-        for i in range(columns):
-            column = []
-            note = starting_note
-            for j in range(rows):
-                if j % 4 == 0: index = 0
-                column.append(Note(note, correct_index(index, i, CORRECT_INDEX), send))
-                index += 1
-                note += 1
-            grid.append(tuple(column))
-        self.grid = tuple(grid)
-
-class Cell:
-    __slots__ = ["index", "is_on"]
-    def __init__(self, index):
-        self.index = index
-        self.is_on = False
-        
-    def toggle(self):
-        self.is_on = True if not self.is_on else False
-        
-    def on(self):
-        self.is_on = True
-        
-    def off(self):
-        self.is_on = False
-
-class Note(Cell):
-    __slots__ = ["notes", "index", "is_on", "is_accented", "send"]
-    def __init__(self, note, index, send):
-        self.note = note
-        self.index = index
-        self.is_on = False
-        self.is_accented = False
-        self.send = send
-        
-    def play(self, note_on, note_off):
-        self.stop(note_off)
-        if self.is_on:
-            self.send(note_on(self.note, 127 if self.is_accented else 96))
-        
-    def stop(self, note_off):
-        if self.is_on:
-            self.send(note_off(self.note, 0))
-        
-    def toggle_accent(self):
-        self.is_accented = True if not self.is_accented else False
\ No newline at end of file
+    __slots__ = ["measures", "columns", "notes", "channels", "order", "dirty"]
+    def __init__(self, columns, rows, starting_note):
+        self.columns = columns
+        self.measures = [Measure()] * ((columns + 7) // 8) # positions may share a measure until one is edited
+        self.dirty = bytearray([1] * (len(self.measures) + 1)) # per measure position changed since the last save, then the routing
+        self.notes = bytearray(range(starting_note, starting_note + rows)) # row -> MIDI note
+        self.channels = bytearray(rows) # row -> MIDI channel
+        self.order = bytes(range(rows)) # rows by channel, so a step plays each channel as one running status burst
+
+    def bits(self, col):
+        return self.measures[col >> 3].on[col & 7]
+
+    def accents(self, col):
+        return self.measures[col >> 3].accent[col & 7]
+
+    def events(self, col):
+        return self.measures[col >> 3].events[col & 7]
+
+    def is_on(self, col, row):
+        return self.bits(col) >> row & 1
+
+    def is_accented(self, col, row):
+        return self.accents(col) >> row & 1
+
+    def writable(self, col): # copy the measure holding col if another position shares it
+        i = col >> 3
+        measure = self.measures[i]
+        if self.measures.count(measure) > 1:
+            measure = self.measures[i] = Measure(measure)
+        return measure
+
+    def set_column(self, col, bits, accents):
+        accents &= bits
+        if self.bits(col) == bits and self.accents(col) == accents: return
+        measure = self.writable(col)
+        self.dirty[col >> 3] = 1
+        measure.on[col & 7] = bits
+        measure.accent[col & 7] = accents
+        self.compile(col)
+
+    def set(self, col, row, is_on=True, is_accented=False):
+        bits, accents = self.bits(col) & ~(1 << row), self.accents(col) & ~(1 << row)
+        if is_on: bits |= 1 << row
+        if is_on and is_accented: accents |= 1 << row
+        self.set_column(col, bits, accents)
+
+    def toggle(self, col, row):
+        self.set_column(col, self.bits(col) ^ 1 << row, self.accents(col))
+
+    def toggle_accent(self, col, row):
+        self.set_column(col, self.bits(col), self.accents(col) ^ 1 << row)
+
+    def clear(self):
+        self.measures = [Measure()] * len(self.measures)
+        self.clean(1)
+
+    def clean(self, is_dirty=0): # once the grid matches what flash holds
+        r = range(len(self.dirty))
+        for i in r: self.dirty[i] = is_dirty
+
+    def is_dirty(self):
+        return any(self.dirty)
+
+    def route(self, row, note, channel): # call compile_all once the routing is done
+        self.dirty[-1] = 1
+        self.notes[row] = note
+        self.channels[row] = channel
+        self.order = bytes(sorted(range(len(self.notes)), key=lambda i: self.channels[i]))
+
+    def duplicate(self, src, dst): # measure positions
+        self.measures[dst] = self.measures[src]
+        self.dirty[dst] = 1
+
+    def compile(self, col):
+        measure = self.measures[col >> 3]
+        bits, acct_bits = measure.on[col & 7], measure.accent[col & 7]
+        events = bytearray()
+        for i in self.order:
+            if bits >> i & 1:
+                events.append(self.channels[i])
+                events.append(self.notes[i])
+                events.append(ACCENT_VELOCITY if acct_bits >> i & 1 else NOTE_VELOCITY)
+        measure.events[col & 7] = bytes(events)
+
+    def compile_all(self):
+        r = range(self.columns)
+        for i in r: self.compile(i)
+
+class Scheduler:
+    __slots__ = ["offsets", "table", "length"]
+    def __init__(self, offsets, last_step):
+        self.offsets = offsets # tick offset of each grid within a step
+        self.compile(last_step)
+
+    def compile(self, last_step):
+        self.length = last_step * TICKS_PER_STEP
+        table = [()] * self.length
+        for grid, offs in enumerate(self.offsets):
+            for step in range(last_step):
+                tick = (step * TICKS_PER_STEP + offs) % self.length
+                table[tick] = table[tick] + ((grid, step),)
+        self.table = table # (grid, step to play) for every tick of the loop
+
+    def at(self, tick):
+        return self.table[tick % self.length]
+
+class Recorder:
+    __slots__ = ["ticks", "rows", "bases", "head", "count", "ready", "targets", "strength"]
+    def __init__(self, size):
+        self.ticks = array('H', [0] * size) # loop tick each hit landed on
+        self.rows = bytearray(size)
+        self.bases = bytearray(size) # column base of the measure playing at the hit
+        self.head = 0
+        self.count = 0
+        self.ready = False # a step boundary passed with hits waiting
+        self.targets = RECORD_TARGETS[0]
+        self.strength = RECORD_STRENGTHS[0]
+
+    def hit(self, tick, row, base):
+        size = len(self.rows)
+        if self.count == size: return False
+        i = (self.head + self.count) % size
+        self.ticks[i] = tick
+        self.rows[i] = row
+        self.bases[i] = base
+        self.count += 1
+        return True
+
+    def quantize(self, tick, offsets): # (grid, step) of the nearest target, may be -1 or the step after the loop
+        half = TICKS_PER_STEP // 2
+        main = (tick + half) // TICKS_PER_STEP * TICKS_PER_STEP
+        tick += (main - tick) * self.strength // 100
+        best = None
+        for grid in self.targets:
+            offs = offsets[grid]
+            step = (tick - offs + half) // TICKS_PER_STEP
+            distance = abs(step * TICKS_PER_STEP + offs - tick)
+            if best is None or distance < best:
+                best, found = distance, (grid, step)
+        return found
+
+    def commit(self, offsets, place):
+        size = len(self.rows)
+        while self.count:
+            i = self.head
+            grid, step = self.quantize(self.ticks[i], offsets)
+            place(grid, step, self.rows[i], self.bases[i])
+            self.head = (i + 1) % size
+            self.count -= 1
+        self.ready = False
+
+class Journal:
+    __slots__ = ["keys", "values", "start", "used", "cursor", "opening", "first", "on", "accent", "routing", "state"]
+    def __init__(self, size, grids, columns, rows):
+        self.keys = array('H', [0] * size) # grid << 8 | column, or a routing row or the state
+        self.values = array('H', [0] * (4 * size)) # two words before the change, two after
+        self.start = 0 # ring position of the oldest diff
+        self.used = 0 # diffs kept
+        self.cursor = 0 # diffs applied, those after it can be redone
+        self.opening = True # the next diff begins an action, None while an action too big to keep goes on
+        self.first = 0 # diffs before the first one of the action being added
+        self.on = array('H', [0] * (grids * columns)) # grids as they were when the action began
+        self.accent = array('H', [0] * (grids * columns))
+        self.routing = bytearray(2 * grids * rows)
+        self.state = (0, 0)
+
+    def clear(self):
+        self.start = self.used = self.cursor = 0
+
+    def begin(self, grids, state): # before an action that may change any part of grids
+        for g, grid in enumerate(grids):
+            r = range(grid.columns)
+            for col in r:
+                i = g * grid.columns + col
+                self.on[i], self.accent[i] = grid.bits(col), grid.accents(col)
+            rows = len(grid.notes)
+            self.routing[2 * g * rows:(2 * g + 1) * rows] = grid.notes
+            self.routing[(2 * g + 1) * rows:(2 * g + 2) * rows] = grid.channels
+        self.state = state
+
+    def end(self, grids, state): # keep what the action changed
+        self.opening = True
+        if state != self.state: self.add(JOURNAL_STATE << 8, self.state, state)
+        for g, grid in enumerate(grids):
+            rows = len(grid.notes)
+            r = range(rows)
+            for row in r:
+                note, channel = self.routing[2 * g * rows + row], self.routing[(2 * g + 1) * rows + row]
+                if note != grid.notes[row] or channel != grid.channels[row]:
+                    self.add(g << 8 | JOURNAL_ROUTE | row, (note, channel), (grid.notes[row], grid.channels[row]))
+            r = range(grid.columns)
+            for col in r:
+                i = g * grid.columns + col
+                if self.on[i] != grid.bits(col) or self.accent[i] != grid.accents(col):
+                    self.add(g << 8 | col, (self.on[i], self.accent[i]), (grid.bits(col), grid.accents(col)))
+
+    def add(self, key, before, after):
+        if self.opening is None: return
+        if self.opening:
+            self.used = self.first = self.cursor # a new action drops what could be redone
+            key |= JOURNAL_BEGIN
+            self.opening = False
+        size = len(self.keys)
+        if self.used == size: self.evict()
+        if self.opening is None: return
+        i = (self.start + self.used) % size
+        self.keys[i] = key
+        self.values[4 * i], self.values[4 * i + 1] = before
+        self.values[4 * i + 2], self.values[4 * i + 3] = after
+        self.used += 1
+        self.cursor = self.used
+
+    def evict(self): # drop the oldest action
+        size = len(self.keys)
+        while self.used:
+            self.start = (self.start + 1) % size
+            self.used -= 1
+            self.first -= 1
+            if self.used and self.keys[self.start] & JOURNAL_BEGIN: break
+        self.cursor = self.used
+        if self.first < 0: self.opening = None # the action being added lost its first diff
+
+    def undo(self, apply): # apply(grid, column, first word, second word) for each diff of the latest action
+        size = len(self.keys)
+        if not self.cursor: return False
+        while self.cursor:
+            self.cursor -= 1
+            i = (self.start + self.cursor) % size
+            key = self.keys[i]
+            apply(key >> 8 & 0x7F, key & 0xFF, self.values[4 * i], self.values[4 * i + 1])
+            if key & JOURNAL_BEGIN: break
+        return True
+
+    def redo(self, apply):
+        size = len(self.keys)
+        if self.cursor == self.used: return False
+        while True:
+            i = (self.start + self.cursor) % size
+            key = self.keys[i]
+            apply(key >> 8 & 0x7F, key & 0xFF, self.values[4 * i + 2], self.values[4 * i + 3])
+            self.cursor += 1
+            if self.cursor == self.used or self.keys[(self.start + self.cursor) % size] & JOURNAL_BEGIN: break
+        return True
+
+class FrameBuffer:
+    __slots__ = ["pixels", "dirty", "is_dirty", "strip", "shown"]
+    def __init__(self, strip, size):
+        self.strip = strip # NeoPixel with auto_write off, only written by flush
+        self.pixels = [(0, 0, 0)] * size
+        self.dirty = bytearray(size)
+        self.is_dirty = False
+        self.shown = min(size, len(strip)) # pixels of boards past the strip are kept but never shown
+
+    def __len__(self):
+        return self.shown
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def __setitem__(self, index, color):
+        if self.pixels[index] != color:
+            self.pixels[index] = color
+            self.dirty[index] = 1
+            self.is_dirty = True
+
+    def fill(self, color):
+        r = range(len(self.pixels))
+        for i in r: self[i] = color
+
+    def flush(self):
+        if not self.is_dirty: return
+        r = range(self.shown)
+        for i in r:
+            if self.dirty[i]:
+                self.strip[i] = self.pixels[i]
+                self.dirty[i] = 0
+        self.strip.show()
+        self.is_dirty = False
+
+class SaveQueue:
+    __slots__ = ["buffer", "jobs", "slot", "image", "regions", "file", "phase", "pieces", "piece", "written"]
+    def __init__(self, size):
+        self.buffer = bytearray(size) # scratch for encoding, the snapshot is kept as bytes
+        self.jobs = [] # (slot, image, regions) waiting behind the job in progress
+        self.slot = None
+        self.image = None # snapshot of the pattern being written
+        self.regions = None # byte ranges of the slot file to rewrite, None for all of it
+        self.file = None
+        self.phase = SAVE_DIRECT
+        self.pieces = [] # (offset to seek to or None, bytes) written by this phase
+        self.piece = 0
+        self.written = 0 # bytes of the current piece written
+
+    def put(self, slot, grids, last_step, axis_modes): # never writes, the job waits for the idle loops
+        old = slot_cache.get(slot) # what the slot file holds once the queue ahead of it is written
+        if old is not None and slot_clean(old, grids, last_step, axis_modes): return
+        size = encode_slot(self.buffer, grids, last_step, axis_modes)
+        regions = slot_regions(self.buffer, size, old, grids) if old is not None else None
+        for grid in grids: grid.clean()
+        if regions == []: return
+        image = bytes(memoryview(self.buffer)[:size])
+        cache_image(slot, image)
+        self.jobs.append((slot, image, regions))
+        if self.slot is None: self.next()
+
+    def holds(self, slot):
+        return slot == self.slot or any(job[0] == slot for job in self.jobs)
+
+    def next(self):
+        if not self.jobs:
+            self.slot = self.image = None
+            return
+        self.slot, self.image, self.regions = self.jobs.pop(0)
+        view, size = memoryview(self.image), len(self.image)
+        if not get_slots()[self.slot]: # nothing to lose, write the file straight away
+            return self.start(SAVE_DIRECT, [ (0, view) ])
+        regions = self.regions or [ (0, size) ]
+        log = bytearray(SAVE_LOG_HEADER + 4 * len(regions))
+        log[0:2] = SAVE_LOG_MAGIC
+        log[2] = self.regions is None
+        log[3] = len(regions)
+        write_word(log, 4, size)
+        for k, (start, end) in enumerate(regions):
+            write_word(log, SAVE_LOG_HEADER + 4 * k, start)
+            write_word(log, SAVE_LOG_HEADER + 4 * k + 2, end)
+        self.start(SAVE_LOG, [ (None, log) ] + [ (None, view[start:end]) for start, end in regions ] + [ (None, SAVE_LOG_COMMIT) ])
+
+    def start(self, phase, pieces):
+        self.phase, self.pieces = phase, pieces
+        self.piece = self.written = 0
+
+    def step(self, chunk=SAVE_CHUNK):
+        if self.slot is None: return
+        try:
+            if self.file is None:
+                path = '/{}.{}'.format(self.slot, 'jnl' if self.phase == SAVE_LOG else 'bin')
+                self.file = open(path, "r+b" if self.phase == SAVE_APPLY and self.regions else "wb")
+            offset, data = self.pieces[self.piece]
+            if offset is not None and not self.written: self.file.seek(offset)
+            end = min(self.written + chunk, len(data))
+            self.file.write(data[self.written:end])
+            self.written = end
+            if end < len(data): return
+            self.piece += 1
+            self.written = 0
+            if self.piece < len(self.pieces): return
+            self.file.close() # the log is complete once closed, so the slot file may be patched
+            self.file = None
+            if self.phase == SAVE_LOG:
+                view = memoryview(self.image)
+                return self.start(SAVE_APPLY, [ (start, view[start:end]) for start, end in self.regions or [ (0, len(self.image)) ] ])
+            if self.phase == SAVE_APPLY: remove('/{}.jnl'.format(self.slot))
+            save_written(self.slot)
+        except OSError as e:
+            if self.file is not None:
+                try: self.file.close()
+                except OSError: pass
+                self.file = None
+            uncache_slot(self.slot) # the cache only holds what flash holds, a committed log is replayed on the next load
+            save_failed(e)
+            self.jobs = [ (slot, image, None if slot == self.slot else regions) for slot, image, regions in self.jobs ] # deltas assumed this write
+        self.next()
+
+    def flush(self):
+        while self.slot is not None: self.step()
+
+class Chain:
+    __slots__ = ["entries", "position", "played", "grids", "schedule", "slot", "last_step", "axis_modes", "outgoing"]
+    def __init__(self, grids, schedule):
+        self.entries = [] # [slot, loops to play it] in playing order
+        self.position = -1
+        self.played = 0
+        self.grids = grids # standby pattern, read from flash before the loop it plays in
+        self.schedule = schedule
+        self.slot = None # slot held by the standby pattern, None until it is read
+        self.last_step = 8
+        self.axis_modes = [ None, None, None ]
+        self.outgoing = None # (slot, last step, axis modes, rotation) of a standby pattern still to be saved
+
+    def add(self, slot):
+        if self.entries and self.entries[-1][0] == slot: self.entries[-1][1] += 1
+        else: self.entries.append([slot, 1])
+
+    def clear(self):
+        self.entries = []
+        self.position = -1
+        self.played = 0
+        self.slot = None
+
+    def repeats(self):
+        return self.position >= 0 and self.played + 1 < self.entries[self.position][1]
+
+    def upcoming(self): # position that plays in the next loop
+        return self.position if self.repeats() else (self.position + 1) % len(self.entries)
+
+    def advance(self, slot): # at the end of every loop, True when the standby pattern plays next
+        if not self.entries: return False
+        upcoming = self.upcoming()
+        swap = self.entries[upcoming][0] != slot
+        if swap and self.slot != self.entries[upcoming][0]: return False # not read in time, try next loop
+        self.played = self.played + 1 if self.repeats() else 0
+        self.position = upcoming
+        return swap
+
+    def swap(self, grids, schedule, slot, last_step, axis_modes, rotation):
+        standby = [ self.grids, self.schedule, self.slot, self.last_step, self.axis_modes ]
+        self.grids, self.schedule, self.slot = grids, schedule, None
+        self.outgoing = (slot, last_step, axis_modes, rotation)
+        return standby
+
+    def store(self, queue):
+        if self.outgoing is None: return
+        slot, last_step, axis_modes, rotation = self.outgoing
+        if rotation:
+            for grid in self.grids: rotate_grid(grid, rotation, last_step)
+        queue.put(slot, self.grids, last_step, axis_modes)
+        self.outgoing = None
+
+    def prefetch(self, slot, queue): # one flash job per call, run while the clock is idle
+        if self.outgoing is not None: return self.store(queue)
+        if not self.entries: return
+        upcoming = self.entries[self.upcoming()][0]
+        if upcoming == slot or upcoming == self.slot: return
+        if queue.holds(upcoming) and upcoming not in slot_cache: queue.flush()
+        for grid in self.grids: clear_grid(grid)
+        [ _, _, self.last_step, self.axis_modes ] = read_save(upcoming, self.grids[0], self.grids[1])
+        self.schedule.compile(self.last_step)
+        self.slot = upcoming
+
+class SongStream:
+    __slots__ = ["grids", "schedule", "file", "writable", "measures", "loaded", "dirty", "playing", "buffer", "building", "source", "length", "built"]
+    def __init__(self, grids):
+        self.grids = grids # ring of SONG_RING measures per grid, song measure m sits at m % SONG_RING
+        self.schedule = Scheduler(GRID_OFFSETS, 8)
+        self.file = None
+        self.writable = False
+        self.measures = 0
+        self.loaded = array('h', [-1] * SONG_RING) # song measure held at each ring position
+        self.dirty = bytearray(SONG_RING)
+        self.playing = 0
+        self.buffer = bytearray(SONG_CHUNK)
+        self.building = None # song file being made, one measure per build()
+        self.source = bytearray(SLOT_MEASURES * SONG_CHUNK) # measures of the pattern it is made from
+        self.length = 0
+        self.built = 0
+
+    def active(self):
+        return self.file is not None
+
+    def create(self, path, grids, last_step, measures): # tile a pattern over the song, written by build()
+        self.length = (last_step + 7) // 8
+        for m in range(self.length):
+            encode_measure(self.buffer, grids, m * 8, last_step)
+            self.source[m * SONG_CHUNK:(m + 1) * SONG_CHUNK] = self.buffer
+        header = bytearray(SONG_HEADER)
+        header[0:2] = SONG_MAGIC
+        header[2] = SONG_VERSION
+        header[3] = len(grids[0].notes)
+        header[6] = len(grids) # the measure count is written last, so a song cut short is made again
+        self.building = open(path, "wb")
+        self.building.write(header)
+        self.measures, self.built = measures, 0
+
+    def build(self): # write the next measure of a new song, True once it is complete
+        try:
+            start = self.built % self.length * SONG_CHUNK
+            self.building.write(memoryview(self.source)[start:start + SONG_CHUNK])
+            self.built += 1
+            if self.built < self.measures: return False
+            self.building.seek(4)
+            write_word(self.buffer, 0, self.measures)
+            self.building.write(memoryview(self.buffer)[:2])
+            self.building.close()
+            self.building = None
+            return True
+        except OSError as e:
+            print(e)
+            self.cancel()
+            return False
+
+    def cancel(self): # the header has no measure count yet, so the song is made again next time
+        try: self.building.close()
+        except OSError: pass
+        self.building = None
+
+    def play(self, path, grids, last_step): # True once the song is open, False while it is made from the pattern
+        if self.building is not None: return False
+        try:
+            self.open(path)
+            return True
+        except OSError: pass # no song yet
+        except ValueError as e: print(e) # made by another version, start over
+        self.create(path, grids, last_step, SONG_MEASURES)
+        return False
+
+    def open(self, path):
+        try:
+            self.file, self.writable = open(path, "r+b"), True
+        except OSError: # the filesystem may be owned by the USB host, play without saving edits
+            self.file, self.writable = open(path, "rb"), False
+        header = self.file.read(SONG_HEADER)
+        if len(header) < SONG_HEADER or header[0:2] != SONG_MAGIC or header[2] != SONG_VERSION or header[6] != len(self.grids) or not read_word(header, 4):
+            self.close()
+            raise ValueError("not a song file")
+        self.measures = read_word(header, 4)
+        self.playing = 0
+        for i in range(SONG_RING): self.loaded[i] = -1
+        self.load(0)
+
+    def close(self):
+        if self.file is None: return
+        for i in range(SONG_RING):
+            if self.dirty[i]: self.write(i)
+        self.file.close()
+        self.file = None
+
+    def base(self): # first ring column of the playing measure
+        return self.playing % SONG_RING * 8
+
+    def advance(self): # at the end of every measure
+        self.playing = (self.playing + 1) % self.measures
+        if self.loaded[self.playing % SONG_RING] != self.playing: self.load(self.playing) # read ahead fell behind
+        return self.base()
+
+    def touch(self, col):
+        self.dirty[col >> 3] = 1
+
+    def seek(self, measure):
+        self.file.seek(SONG_HEADER + measure * SONG_CHUNK)
+
+    def load(self, measure):
+        pos = measure % SONG_RING
+        if self.dirty[pos]: self.write(pos)
+        self.seek(measure)
+        if self.file.readinto(self.buffer) == SONG_CHUNK: decode_measure(self.buffer, self.grids, pos * 8)
+        self.loaded[pos] = measure
+
+    def write(self, pos):
+        self.dirty[pos] = 0
+        if not self.writable or self.loaded[pos] < 0: return
+        try:
+            self.seek(self.loaded[pos])
+            self.file.write(memoryview(self.buffer)[:encode_measure(self.buffer, self.grids, pos * 8, pos * 8 + 8)])
+            self.file.flush()
+        except OSError as e:
+            print(e)
+            self.writable = False
+
+    def prefetch(self): # one flash job per call, run while the clock is idle
+        if self.file is None: return
+        for k in range(1, min(SONG_RING, self.measures)):
+            measure = (self.playing + k) % self.measures
+            if self.loaded[measure % SONG_RING] != measure: return self.load(measure)
+        for i in range(SONG_RING): # edits are saved once their measure is done playing
+            if self.dirty[i] and i != self.playing % SONG_RING: return self.write(i)
+
+class MidiInput:
+    __slots__ = ["receive", "kinds", "command_kinds", "realtime", "count", "clocks", "commands", "other", "late_ticks"]
+    def __init__(self, receive, kinds, size, command_kinds=()):
+        self.receive = receive
+        self.kinds = kinds # realtime message classes, kinds[0] is the clock
+        self.command_kinds = command_kinds # message classes that are never coalesced
+        self.realtime = [None] * size # realtime messages of this drain, in arrival order
+        self.count = 0
+        self.clocks = 0 # clocks read by this drain
+        self.commands = [] # command messages of this drain, in arrival order
+        self.other = {} # latest non-realtime message per type and control
+        self.late_ticks = 0
+
+    def drain(self):
+        self.count = 0
+        if self.commands: self.commands = []
+        self.other.clear()
+        clocks = 0
+        r = range(len(self.realtime))
+        for i in r:
+            message = self.receive()
+            if message is None: break
+            if isinstance(message, self.kinds):
+                self.realtime[self.count] = message
+                self.count += 1
+                if isinstance(message, self.kinds[0]): clocks += 1
+            elif isinstance(message, self.command_kinds):
+                self.commands.append(message)
+            else:
+                self.other[(type(message), getattr(message, "control", None))] = message
+        if clocks > 1: self.late_ticks += clocks - 1
+        self.clocks = clocks
+
+class MidiOutput:
+    __slots__ = ["port", "buffer", "size", "status"]
+    def __init__(self, port, size):
+        self.port = port
+        self.buffer = bytearray(size) # messages of this loop, sent in one write
+        self.size = 0
+        self.status = 0 # last status byte in buffer, repeated messages leave it out
+
+    def message(self, status, data1, data2):
+        if self.size + 3 > len(self.buffer): self.flush()
+        if status != self.status:
+            self.buffer[self.size] = status
+            self.size += 1
+            self.status = status
+        self.buffer[self.size] = data1
+        self.buffer[self.size+1] = data2
+        self.size += 2
+
+    def note_on(self, note, velocity, channel=0):
+        self.message(0x90 | channel, note, velocity)
+
+    def note_off(self, note, channel=0): # note on with velocity 0 keeps running status across a step
+        self.message(0x90 | channel, note, 0)
+
+    def control_change(self, control, value, channel=0):
+        self.message(0xB0 | channel, control, value)
+
+    def realtime(self, status): # realtime bytes may sit between messages without breaking running status
+        if self.size + 1 > len(self.buffer): self.flush()
+        self.buffer[self.size] = status
+        self.size += 1
+
+    def sysex(self, manufacturer, data):
+        self.flush()
+        message = bytearray(b'\xf0') + manufacturer + data + b'\xf7'
+        self.port.write(message, len(message))
+
+    def flush(self):
+        if not self.size: return
+        self.port.write(self.buffer, self.size)
+        self.size = 0
+        self.status = 0 # every write starts with a status byte
+
+class MasterClock:
+    __slots__ = ["out", "mode", "bpm", "running", "next", "error", "last", "interval", "received_ticks", "sent_ticks"]
+    def __init__(self, out, bpm):
+        self.out = out
+        self.mode = CLOCK_EXTERNAL
+        self.bpm = bpm
+        self.running = False
+        self.next = 0 # ms the next tick is due
+        self.error = 0 # part of a ms carried from tick to tick so the period never drifts
+        self.last = None # ms of the latest received clock
+        self.interval = 0 # mean ms between received clocks, in 1/16 ms
+        self.received_ticks = 0
+        self.sent_ticks = 0
+
+    def period(self): # ms per tick as numerator, denominator
+        return (60000 // 24, self.bpm) if self.mode == CLOCK_INTERNAL else (self.interval, 16)
+
+    def tempo(self):
+        return self.bpm if self.mode == CLOCK_INTERNAL else 60000 * 16 // 24 // self.interval if self.interval else 0
+
+    def received(self, now): # an incoming clock, True when it is played as it arrives
+        if self.mode == CLOCK_EXTERNAL: return True
+        if self.mode == CLOCK_FOLLOW:
+            if self.last is not None:
+                interval = ((now - self.last) & (TICKS_PERIOD - 1)) * 16
+                self.interval += (interval - self.interval) >> CLOCK_SMOOTHING if self.interval else interval
+            self.last = now
+            self.received_ticks += 1
+        return False
+
+    def start(self, now):
+        if self.mode == CLOCK_EXTERNAL: return
+        self.running = True
+        self.next, self.error = now, 0
+        self.received_ticks = self.sent_ticks = 0
+        self.out.realtime(0xFA)
+
+    def stop(self):
+        if self.mode == CLOCK_EXTERNAL: return
+        self.running = False
+        self.out.realtime(0xFC)
+
+    def due(self, now): # ticks to play now, each one is also sent out
+        if not self.running: return 0
+        num, den = self.period()
+        limit, force = CLOCK_CATCH_UP, 0
+        if self.mode == CLOCK_FOLLOW: # stay within a tick of the clock being followed
+            ahead = self.sent_ticks - self.received_ticks
+            limit = min(limit, 1 - ahead if num else -ahead)
+            force = -1 - ahead
+        count = 0
+        while count < limit and (count < force or (now - self.next) & (TICKS_PERIOD - 1) < TICKS_PERIOD >> 1):
+            self.error += num
+            self.next = (self.next + self.error // den) & (TICKS_PERIOD - 1)
+            self.error %= den
+            self.out.realtime(0xF8)
+            count += 1
+        if (now - self.next) & (TICKS_PERIOD - 1) < TICKS_PERIOD >> 1: self.next = now # too far behind, skip ahead rather than burst
+        self.sent_ticks += count
+        return count
+
+    def spare(self, now): # ms until the next tick is due
+        if not self.running: return TICKS_PERIOD
+        spare = (self.next - now) & (TICKS_PERIOD - 1)
+        return spare if spare < TICKS_PERIOD >> 1 else 0
+
+class HeapMonitor:
+    __slots__ = ["names", "budgets", "enabled", "last", "peak", "total", "passes", "collections"]
+    def __init__(self, names, budgets):
+        self.names = names
+        self.budgets = budgets # bytes a section may allocate in one pass
+        self.enabled = False
+        self.last = 0 # mem_alloc at the previous mark
+        self.peak = array('l', [0] * len(names))
+        self.total = array('l', [0] * len(names))
+        self.passes = array('l', [0] * len(names))
+        self.collections = array('l', [0] * len(names))
+
+    def enable(self, on):
+        self.enabled = on and mem_alloc is not None
+        for counts in (self.peak, self.total, self.passes, self.collections):
+            for i in range(len(counts)): counts[i] = 0
+        if self.enabled: self.last = mem_alloc()
+
+    def begin(self):
+        if self.enabled: self.last = mem_alloc()
+
+    def mark(self, section): # allocations since the previous mark belong to section
+        if not self.enabled: return
+        now = mem_alloc()
+        used = now - self.last
+        self.last = now
+        self.passes[section] += 1
+        if used < 0: # the heap shrank, so a collection ran in this section
+            self.collections[section] += 1
+            return
+        self.total[section] += used
+        if used > self.peak[section]:
+            self.peak[section] = used
+            if used > self.budgets[section]: print("heap:", self.names[section], used, "bytes, budget", self.budgets[section])
+        self.last = mem_alloc() # leave out what printing allocated
+
+    def dump(self):
+        if mem_alloc is None: return
+        print("heap: free", mem_free(), "allocated", mem_alloc())
+        for i in range(len(self.names)):
+            print("heap:", self.names[i], "peak", self.peak[i], "mean", self.total[i] // max(self.passes[i], 1), "collections", self.collections[i], "budget", self.budgets[i])
+
+    def report(self): # sysex payload: free heap, then peak and collections of every section
+        data = bytearray()
+        if mem_alloc is None: return data
+        for value in [ mem_free() ] + [ v for i in range(len(self.names)) for v in (self.peak[i], self.collections[i]) ]:
+            value = min(value, 0x1FFFFF)
+            data.extend((value >> 14 & 0x7F, value >> 7 & 0x7F, value & 0x7F))
+        return data
+
+class TickProfiler:
+    __slots__ = ["names", "times", "late", "handling", "loops", "jitter", "worst", "loop_start", "last", "arrival", "interval", "clocks"]
+    def __init__(self, names, buckets):
+        self.names = names
+        self.times = array('H', [0] * len(names)) # ms each section took in the latest loop
+        self.late = array('l', [0] * len(names)) # late clocks that followed each section being the slowest
+        self.handling = array('l', [0] * buckets) # ms from clock arrival to MIDI out
+        self.loops = array('l', [0] * buckets) # ms per loop
+        self.jitter = array('l', [0] * buckets) # ms between a clock interval and the mean interval
+        self.reset()
+
+    def reset(self):
+        for counts in (self.late, self.handling, self.loops, self.jitter):
+            for i in range(len(counts)): counts[i] = 0
+        self.worst = 0
+        self.loop_start = None
+        self.last = 0
+        self.arrival = None
+        self.interval = 0 # mean ms between clocks, in 1/16 ms
+        self.clocks = 0
+
+    def count(self, histogram, ms):
+        histogram[min(ms, len(histogram) - 1)] += 1
+
+    def begin(self, now):
+        if self.loop_start is not None: self.count(self.loops, (now - self.loop_start) & (TICKS_PERIOD - 1))
+        self.loop_start = self.last = now
+
+    def clock(self, now, clocks): # right after a drain that read clocks
+        if clocks > 1:
+            slowest = 0
+            for i in range(len(self.times)):
+                if self.times[i] > self.times[slowest]: slowest = i
+            self.late[slowest] += clocks - 1
+        if self.arrival is not None:
+            interval = ((now - self.arrival) & (TICKS_PERIOD - 1)) * 16 // clocks
+            if self.interval: self.count(self.jitter, abs(interval - self.interval) >> 4)
+            self.interval += (interval - self.interval) >> 3 if self.interval else interval
+        self.arrival = now
+        self.clocks = clocks
+
+    def mark(self, section, now):
+        self.times[section] = (now - self.last) & (TICKS_PERIOD - 1)
+        self.last = now
+        if section == SECTION_CLOCK and self.clocks: # the clock section ends with the MIDI write
+            handling = (now - self.arrival) & (TICKS_PERIOD - 1)
+            self.count(self.handling, handling)
+            self.worst = max(self.worst, handling)
+            self.clocks = 0
+
+    def dump(self):
+        print("ticks: clock interval", self.interval / 16, "ms, worst handling", self.worst, "ms")
+        print("ticks: handling ms", list(self.handling))
+        print("ticks: loop ms", list(self.loops))
+        print("ticks: jitter ms", list(self.jitter))
+        for i in range(len(self.names)): print("ticks: late after slow", self.names[i], self.late[i])
+
+    def report(self): # sysex payload: interval, worst, then the histograms and late counts as 14 bit values
+        data = bytearray()
+        for values in ((self.interval, self.worst), self.handling, self.loops, self.jitter, self.late):
+            for value in values:
+                value = min(value, 0x3FFF)
+                data.extend((value >> 7, value & 0x7F))
+        return data
+
+class AxisEngine:
+    __slots__ = ["accelerometer", "interval", "smoothing", "threshold", "budget", "last_sample", "tokens", "smoothed", "sent"]
+    def __init__(self, accelerometer, interval, smoothing, threshold, budget):
+        self.accelerometer = accelerometer
+        self.interval = interval # ms between samples
+        self.smoothing = smoothing
+        self.threshold = threshold
+        self.budget = budget # CCs per second
+        self.last_sample = 0
+        self.tokens = budget * 1000 # in 1/1000 CC, so the part of a CC earned each sample is kept
+        self.smoothed = array('i', [0, 0, 0]) # 1/64 m/s^2
+        self.sent = bytearray(b'\xff' * len(AXIS_CCS)) # last value sent on each CC, 255 if none
+
+    def update(self, now, modes, control_change):
+        elapsed = (now - self.last_sample) & (TICKS_PERIOD - 1)
+        if elapsed < self.interval: return
+        self.last_sample = now
+        self.tokens = min(self.tokens + min(elapsed, 1000) * self.budget, self.budget * 1000)
+        accel = self.accelerometer.acceleration
+        for i in range(3):
+            if modes[i] is None: continue
+            self.smoothed[i] += (int(accel[AXIS_ORDER[i]] * 64) - self.smoothed[i]) >> self.smoothing
+            which, value = axis_value(modes[i], self.smoothed[i])
+            index = i * 2 + which
+            last = self.sent[index]
+            if value == last or (last != 0xFF and abs(value - last) < self.threshold and value != 0 and value != 127): continue
+            if self.tokens < 1000: continue
+            self.tokens -= 1000
+            self.sent[index] = value
+            control_change(AXIS_CCS[index], value)
@@ -1,15 +1,12 @@
 from classes import *
 from functions import *
 from constants import *
+from geometry import *
 
-from math import floor
 from board import ACCELEROMETER_SCL
 from board import ACCELEROMETER_SDA
 from busio import I2C
-from json import loads
-from json import dumps
-from os import listdir
-from os import remove
+from supervisor import ticks_ms
 from micropython import const
 
 from usb_midi import ports
@@ -20,41 +17,57 @@ from adafruit_midi import MIDI
 from adafruit_midi.timing_clock import TimingClock
 from adafruit_midi.start import Start
 from adafruit_midi.stop import Stop
-from adafruit_midi.note_off import NoteOff
-from adafruit_midi.note_on import NoteOn
-from adafruit_midi.control_change import ControlChange
+from adafruit_midi.system_exclusive import SystemExclusive
     
 """
 ======== Global Variables ========
 """
 
 midi = MIDI(midi_in=ports[0], midi_out=ports[1], in_channel=0, out_channel=0)
-receive = midi.receive
+midi_in = MidiInput(midi.receive, (TimingClock, Start, Stop), MIDI_DRAIN, (SystemExclusive,))
+midi_out = MidiOutput(ports[1], MIDI_OUT_BUFFER)
+clock = MasterClock(midi_out, CLOCK_BPM)
 trellis = TrellisM4Express(rotation=90)
 i2c = I2C(ACCELEROMETER_SCL, ACCELEROMETER_SDA)
 accelerometer = ADXL345(i2c)
+heap = HeapMonitor(SECTION_NAMES, HEAP_BUDGETS)
+profile = TickProfiler(SECTION_NAMES, PROFILE_BUCKETS)
+axes = AxisEngine(accelerometer, AXIS_SAMPLE_MS, AXIS_SMOOTHING, AXIS_THRESHOLD, AXIS_CC_BUDGET)
 
-neop = trellis.pixels._neopixel
-fill = trellis.pixels.fill
+strip = trellis.pixels._neopixel
+strip.auto_write = False
+neop = FrameBuffer(strip, surface.pixels)
+fill = neop.fill
 
 current_slot = 0
+sync_slots()
+save_queue = SaveQueue(SLOT_SIZE)
 [ notes, shift, last_step, axis_modes ] = read_save(
         current_slot,
-        NoteGrid(NUMBER_OF_COLUMNS, NUMBER_OF_ROWS, STARTING_NOTE, midi.send),
-        NoteGrid(NUMBER_OF_COLUMNS, NUMBER_OF_ROWS, STARTING_NOTE, midi.send)
+        NoteGrid(NUMBER_OF_COLUMNS, NUMBER_OF_ROWS, STARTING_NOTE),
+        NoteGrid(NUMBER_OF_COLUMNS, NUMBER_OF_ROWS, STARTING_NOTE)
     )
-#TODO can notes and shift be combined into a single tuple?
-#TODO can there be a third note grid to make a triplet/swing feel?
+grids = (notes, shift) # one grid per entry of GRID_OFFSETS
+schedule = Scheduler(GRID_OFFSETS, last_step)
+chain = Chain((NoteGrid(NUMBER_OF_COLUMNS, NUMBER_OF_ROWS, STARTING_NOTE), NoteGrid(NUMBER_OF_COLUMNS, NUMBER_OF_ROWS, STARTING_NOTE)),
+              Scheduler(GRID_OFFSETS, 8))
+sounding = [ b'' ] * len(grids) # notes each grid is holding until its next step
+recorder = Recorder(RECORD_RING)
+journal = Journal(JOURNAL_SIZE, len(grids), NUMBER_OF_COLUMNS, NUMBER_OF_ROWS)
+rerouted = False # an undo or redo changed the routing of a row
+stream = SongStream((NoteGrid(SONG_RING * 8, NUMBER_OF_ROWS, STARTING_NOTE), NoteGrid(SONG_RING * 8, NUMBER_OF_ROWS, STARTING_NOTE)))
+pattern = None # grids, schedule, last step and column offset of the pattern while a song plays
+song_request = None # slot and mode the song combo was pressed in while the song is being made
 cc_edit = Grid(8, 4)
 pattern_select = Grid(8, 4)
 
 ticks = 0
+loop_tick = 0 # ticks since the pattern last started over
 eighth_note = 0
 
-old_message = None
 last_press = None
 held_note = None
-last_tick = None
+lit_step = None
 tick_placeholder = None
 
 button_is_held = False
@@ -64,18 +77,581 @@ separate_manual_note_channel = False
 
 row_offset = 0
 column_offset = 0
+rotation = 0 # steps the pattern plays ahead of how it is stored, set by pattern shift
+column_base = 0 # first column of the playing measure in song mode
 
 mode = b'm'
 
 manual_notes = []
 prev_manual_notes = []
+monitored = [ None ] * NUMBER_OF_ROWS # note and channel sounding for each held record pad
 manual_cc = []
 prev_manual_cc = []
 toggled_cc = []
 
+"""
+======== Combo Handlers ========
+"""
+
+def redraw():
+    reset_colors(notes if mode == b'm' else shift, neop, NOTE_ON if mode == b'm' else SHIFT_NOTE_ON, NOTE_OFF, row_offset, column_offset, rotation, last_step)
+
+def materialize():
+    global rotation
+    if rotation:
+        for grid in grids: rotate_grid(grid, rotation, last_step)
+        rotation = 0
+
+def swap_chain():
+    global notes, shift, grids, schedule, current_slot, last_step, axis_modes, rotation
+    [ grids, schedule, current_slot, last_step, axis_modes ] = chain.swap(grids, schedule, current_slot, last_step, axis_modes, rotation)
+    notes, shift = grids
+    rotation = 0
+    journal.clear()
+    if mode in GRID_MODES and not combo_pressed: redraw()
+
+def enter_song():
+    global notes, shift, grids, schedule, last_step, column_offset, column_base, loop_tick, pattern, song_request
+    materialize()
+    for grid, ring in zip(grids, stream.grids): copy_routing(grid, ring)
+    song_request = None
+    try:
+        if not stream.play(SONG_PATH, grids, last_step):
+            song_request = (current_slot, mode)
+            print("song: making", SONG_PATH)
+            return
+    except OSError as e:
+        print(e)
+        return
+    pattern = (grids, schedule, last_step, column_offset)
+    grids, schedule, last_step = stream.grids, stream.schedule, 8
+    notes, shift = grids
+    column_base = column_offset = stream.base()
+    loop_tick %= schedule.length
+    if mode in GRID_MODES: redraw()
+
+def leave_song():
+    global notes, shift, grids, schedule, last_step, column_offset, column_base
+    stream.close()
+    grids, schedule, last_step, column_offset = pattern
+    notes, shift = grids
+    column_base = 0
+    redraw()
+
+def next_measure():
+    global column_base, column_offset
+    column_base = column_offset = stream.advance()
+    if mode in GRID_MODES and not combo_pressed: redraw()
+
+def song_combo(pressed_buttons):
+    global song_request
+    if stream.active(): leave_song()
+    elif stream.building is not None:
+        stream.cancel()
+        song_request = None
+        print("song: cancelled")
+    else: enter_song()
+
+def clear_combo(pressed_buttons):
+    global rotation
+    if stream.active(): return
+    journal.begin(grids, journal_state())
+    rotation = 0
+    clear_grid(notes)
+    clear_grid(shift)
+    journal.end(grids, journal_state())
+    redraw()
+
+def journal_state(): # rotation and last step, then the slot and its axis modes, as two words
+    modes = 0
+    for i in range(3): modes |= AXIS_MODES.index(axis_modes[i]) << 3 * i
+    return (rotation | last_step << 8, current_slot | modes << 5)
+
+def journal_apply(grid, col, first, second):
+    global rotation, last_step, current_slot, axis_modes, rerouted
+    if grid == JOURNAL_STATE:
+        rotation, last_step = first & 0xFF, first >> 8
+        current_slot = second & 0x1F
+        axis_modes = [ AXIS_MODES[second >> 5 + 3 * i & 7] for i in range(3) ]
+        schedule.compile(last_step)
+        redraw()
+    elif col & JOURNAL_ROUTE:
+        grids[grid].route(col & ~JOURNAL_ROUTE, first, second)
+        rerouted = True
+    else:
+        grids[grid].set_column(col, first, second)
+        step = (col - rotation) % last_step if rotation and col < last_step else col
+        if mode == GRID_MODES[grid] and column_offset <= step < column_offset + surface.width:
+            reset_column(grids[grid], row_offset, step, GRID_COLORS[grid][1], NOTE_OFF, GRID_COLORS[grid][2], neop, rotation, last_step)
+
+def journal_combo(step):
+    global rerouted
+    if stream.active(): return
+    rerouted = False
+    if not step(journal_apply): print("nothing to", "undo" if step == journal.undo else "redo")
+    if rerouted:
+        for grid in grids: grid.compile_all()
+
+def undo_combo(pressed_buttons):
+    journal_combo(journal.undo)
+
+def redo_combo(pressed_buttons):
+    journal_combo(journal.redo)
+
+def shift_mode_combo(pressed_buttons):
+    global mode
+    mode = b's' if mode == b'm' else b'm'
+    redraw()
+
+def edit_cc_combo(pressed_buttons):
+    global mode
+    mode = b'c'
+    reset_colors(cc_edit, neop, EDIT_CC_COLOR, NOTE_OFF)
+
+def select_slot_combo(pressed_buttons):
+    global mode
+    if stream.active(): leave_song()
+    mode = b'p'
+    fill(NOTE_OFF)
+
+def delete_slot_combo(pressed_buttons):
+    global mode
+    if stream.active(): leave_song()
+    mode = b'd'
+    fill(NOTE_OFF)
+
+def chain_combo(pressed_buttons):
+    global mode
+    if stream.active(): leave_song()
+    mode = b'ch'
+    chain.clear()
+    fill(NOTE_OFF)
+
+def profile_combo(pressed_buttons):
+    profile.dump()
+    print("clock:", CLOCK_NAMES[clock.mode], clock.tempo(), "bpm") # measured from the incoming clocks when following
+
+def delete_all_slots_combo(pressed_buttons):
+    global mode
+    if stream.active(): leave_song()
+    mode = b'da'
+    fill(NOTE_OFF)
+
+def leave_edit_cc_combo(pressed_buttons):
+    global mode
+    mode = b'm'
+    redraw()
+
+def change_manual_note_channel_combo(pressed_buttons):
+    global separate_manual_note_channel
+    separate_manual_note_channel = False if separate_manual_note_channel else True
+
+def offset_change_combo(pressed_buttons): #FEAT light up available buttons
+    global row_offset, column_offset
+    if stream.active(): return
+    if len(pressed_buttons) > 2:
+        if pressed_buttons[0] == CHANGE_OFFSET[0]:
+            row_offset = increase_row_offset(row_offset, NUMBER_OF_ROWS)
+        elif pressed_buttons[0] == CHANGE_OFFSET[1]:
+            row_offset = decrease_row_offset(row_offset)
+        elif pressed_buttons[0] == CHANGE_OFFSET[2]:
+            column_offset = increase_column_offset(column_offset, NUMBER_OF_COLUMNS)
+        elif pressed_buttons[0] == CHANGE_OFFSET[3]:
+            column_offset = decrease_column_offset(column_offset)
+        else:
+            return
+        redraw()
+
+def manual_cc_combo(pressed_buttons):
+    global manual_cc, prev_manual_cc
+    for cc in toggled_cc:
+        neop[press_to_light(cc[1])] = MANUAL_CC_COLOR
+    if len(pressed_buttons) > 2:
+        manual_cc = []
+        for button in pressed_buttons:
+            if button == MANUAL_CC_COMBO[0] or button == MANUAL_CC_COMBO[1]:
+                pass
+            else:
+                manual_cc.append((MANUAL_CC[button[0]][button[1]], button))
+    else:
+        manual_cc = []
+    for cc in manual_cc:
+        if cc not in prev_manual_cc:
+            if cc[1][0] <= 1:
+                midi_out.control_change(cc[0], 127)
+                neop[press_to_light(cc[1])] = MANUAL_CC_COLOR
+            if cc[1][0] >= 2:
+                if cc not in toggled_cc:
+                    toggled_cc.append(cc)
+                    midi_out.control_change(cc[0], 127)
+                    neop[press_to_light(cc[1])] = MANUAL_CC_COLOR
+                else:
+                    toggled_cc.remove(cc)
+                    midi_out.control_change(cc[0], 0)
+                    neop[press_to_light(cc[1])] = NOTE_OFF
+    for cc in prev_manual_cc:
+        if cc not in manual_cc:
+            if cc[1][0] <=1:
+                midi_out.control_change(cc[0], 0)
+                neop[press_to_light(cc[1])] = NOTE_OFF
+    prev_manual_cc = manual_cc
+
+def manual_note_combo(pressed_buttons):
+    global manual_notes, prev_manual_notes
+    if len(pressed_buttons) > 2:
+        manual_notes = []
+        for button in pressed_buttons:
+            if button == MANUAL_NOTE_COMBO[0] or button == MANUAL_NOTE_COMBO[1]:
+                pass
+            else:
+                manual_notes.append((MANUAL_NOTES[button[0]][button[1]], button))
+    else:
+        manual_notes = []
+    for note in manual_notes:
+        if note not in prev_manual_notes:
+            midi_out.note_on(note[0], 127, 1 if separate_manual_note_channel else 0)
+            neop[press_to_light(note[1])] = MANUAL_NOTE_COLOR_ALT if separate_manual_note_channel else MANUAL_NOTE_COLOR
+    for note in prev_manual_notes:
+        if note not in manual_notes:
+            midi_out.note_off(note[0], 1 if separate_manual_note_channel else 0)
+            neop[press_to_light(note[1])] = NOTE_OFF
+    prev_manual_notes = manual_notes
+
+def record_hit(grid, step, row, base):
+    target = grids[grid]
+    if stream.active(): col = (base + step) % target.columns
+    else: col = stored_column(step % last_step, rotation, last_step)
+    target.set(col, row, True, target.is_accented(col, row))
+    if stream.active(): stream.touch(col)
+
+def record_note_combo(pressed_buttons):
+    global manual_notes, prev_manual_notes
+    light_buttons(RECORD_BUTTONS, RECORD_SETTING_COLOR, neop)
+    manual_notes = []
+    if len(pressed_buttons) > 2:
+        for button in pressed_buttons:
+            if button in RECORD_NOTE_COMBO: pass
+            elif button[1] < 4:
+                manual_notes.append((MANUAL_NOTES[button[0]][button[1]] - STARTING_NOTE, button))
+            elif button in RECORD_BUTTONS and button not in (last_press or ()):
+                i = RECORD_BUTTONS.index(button)
+                if i < len(RECORD_TARGETS): recorder.targets = RECORD_TARGETS[i]
+                else:
+                    recorder.strength = RECORD_STRENGTHS[(RECORD_STRENGTHS.index(recorder.strength) + 1) % len(RECORD_STRENGTHS)]
+                    print("record strength:", recorder.strength)
+    neop[press_to_light(RECORD_BUTTONS[RECORD_TARGETS.index(recorder.targets)])] = RECORD_NOTE_COLOR
+    for note in manual_notes:
+        if note not in prev_manual_notes:
+            row, monitor = note[0], grids[recorder.targets[0]] # the main grid unless only shift is recorded to
+            monitored[row] = (monitor.notes[row], monitor.channels[row])
+            midi_out.note_on(monitored[row][0], 127, monitored[row][1])
+            recorder.hit(loop_tick, row, column_base)
+            neop[press_to_light(note[1])] = RECORD_NOTE_COLOR
+    for note in prev_manual_notes:
+        if note not in manual_notes:
+            if monitored[note[0]]: midi_out.note_off(monitored[note[0]][0], monitored[note[0]][1])
+            monitored[note[0]] = None
+            neop[press_to_light(note[1])] = NOTE_OFF
+    prev_manual_notes = manual_notes
+
+def pattern_shift_combo(pressed_buttons):
+    global rotation
+    if stream.active(): return
+    light_buttons(PATTERN_SHIFT_BUTTONS, PATTERN_SHIFT_COLOR, neop)
+    if len(pressed_buttons) > 2 and pressed_buttons[0] in PATTERN_SHIFT_BUTTONS:
+        journal.begin(grids, journal_state())
+        if pressed_buttons[0] == PATTERN_SHIFT_BUTTONS[0]:
+            rotation = (rotation + 1) % last_step
+        else:
+            rotation = (rotation - 1) % last_step
+        journal.end(grids, journal_state())
+        redraw()
+
+def clock_combo(pressed_buttons):
+    light_buttons(CLOCK_BUTTONS, CLOCK_COLOR, neop)
+    if len(pressed_buttons) > 2:
+        if pressed_buttons[0] == CLOCK_BUTTONS[0]:
+            stop()
+            clock.mode = (clock.mode + 1) % len(CLOCK_NAMES)
+            print("clock:", CLOCK_NAMES[clock.mode])
+        elif pressed_buttons[0] == CLOCK_BUTTONS[1]:
+            if clock.running: stop()
+            elif clock.mode == CLOCK_INTERNAL: start(ticks_ms())
+        else:
+            clock.bpm = handle_tempo_edit(clock.bpm, pressed_buttons[0], CLOCK_BUTTONS[2:], CLOCK_TEMPI)
+            print("clock:", clock.bpm, "bpm")
+
+def route_combo(pressed_buttons):
+    if len(pressed_buttons) > 2 and pressed_buttons[0][1] in ROUTE_COLUMNS:
+        row = pressed_buttons[0][0] + row_offset
+        note, channel = handle_route_edit(notes if mode == b'm' else shift, row, pressed_buttons[0][1], ROUTE_COLUMNS)
+        print("row", row, "note", note, "channel", channel + 1)
+
+def last_step_edit_combo(pressed_buttons):
+    global last_step
+    if stream.active(): return
+    light_buttons(LAST_STEP_BUTTONS, LAST_STEP_COLOR, neop)
+    if len(pressed_buttons) > 2:
+        journal.begin(grids, journal_state())
+        materialize()
+        last_step = handle_last_step_edit(last_step, pressed_buttons[0], LAST_STEP_BUTTONS, NUMBER_OF_COLUMNS)
+        schedule.compile(last_step)
+        if pressed_buttons[0] == LAST_STEP_BUTTONS[3]:
+            duplicate_measure((notes, shift))
+        journal.end(grids, journal_state())
+
+MAIN_COMBOS = {
+    combo_code(CLEAR_COMBO):                      clear_combo,
+    combo_code(SHIFT_MODE_COMBO):                 shift_mode_combo,
+    combo_code(EDIT_CC_COMBO):                    edit_cc_combo,
+    combo_code(SELECT_SLOT_MODE):                 select_slot_combo,
+    combo_code(DELETE_SLOT_MODE):                 delete_slot_combo,
+    combo_code(DELETE_ALL_SLOTS_MODE):            delete_all_slots_combo,
+    combo_code(UNDO_COMBO):                       undo_combo,
+    combo_code(REDO_COMBO):                       redo_combo,
+    combo_code(CHAIN_MODE):                       chain_combo,
+    combo_code(PROFILE_COMBO):                    profile_combo,
+    combo_code(SONG_MODE):                        song_combo,
+    combo_code(CHANGE_MANUAL_NOTE_CHANNEL_COMBO): change_manual_note_channel_combo,
+}
+
+MAIN_HOLD_COMBOS = { # matched on the last two keys, the rest are arguments
+    combo_code(OFFSET_CHANGE_MODE_COMBO):         offset_change_combo,
+    combo_code(MANUAL_CC_COMBO):                  manual_cc_combo,
+    combo_code(MANUAL_NOTE_COMBO):                manual_note_combo,
+    combo_code(RECORD_NOTE_COMBO):                record_note_combo,
+    combo_code(PATTERN_SHIFT_MODE_COMBO):         pattern_shift_combo,
+    combo_code(LAST_STEP_EDIT_COMBO):             last_step_edit_combo,
+    combo_code(CLOCK_COMBO):                      clock_combo,
+    combo_code(ROUTE_COMBO):                      route_combo,
+}
+
+CC_EDIT_COMBOS = {
+    combo_code(EDIT_CC_COMBO):                    leave_edit_cc_combo,
+}
+
+"""
+======== Mode Handlers ========
+"""
+
+def main_mode(pressed_buttons):
+    global tick_placeholder, held_note, button_is_held, combo_pressed
+    if pressed_buttons and not combo_pressed:
+        tick_placeholder = ticks
+        held_note = (pressed_buttons[0][1] + column_offset, pressed_buttons[0][0] + row_offset)
+        button_is_held = True
+                
+    elif button_is_held:
+        held_grid = notes if mode == b'm' else shift
+        held_index = cell_pixel(held_note[0], held_note[1] % surface.height)
+        col, row = stored_column(held_note[0], rotation, last_step), held_note[1]
+        if ticks - tick_placeholder < HOLD_TIME:
+            if mode == b'm':
+                neop[held_index] = NOTE_ON if not held_grid.is_on(col, row) else NOTE_OFF
+            elif mode == b's':
+                neop[held_index] = SHIFT_NOTE_ON if not held_grid.is_on(col, row) else NOTE_OFF
+            held_grid.toggle(col, row)
+            button_is_held = False
+        else:
+            if not held_grid.is_on(col, row):
+                if mode == b'm':
+                    neop[held_index] = ACCENT if not held_grid.is_accented(col, row) else NOTE_OFF
+                elif mode == b's':
+                    neop[held_index] = SHIFT_NOTE_ON
+                held_grid.toggle(col, row)
+            held_grid.toggle_accent(col, row)
+        if stream.active(): stream.touch(col)
+    if not pressed_buttons:
+        if combo_pressed: redraw()
+        combo_pressed = False
+    
+    if len(pressed_buttons) > 1:
+        combo_pressed = True
+        handler = find_combo(pressed_buttons, MAIN_COMBOS, MAIN_HOLD_COMBOS)
+        if handler: handler(pressed_buttons)
+        else: print(pressed_buttons)
+        button_is_held = False
+
+def edit_cc_mode(pressed_buttons):
+    global combo_pressed
+    handle_cc_grid(cc_edit, axis_modes, 2)
+    reset_colors(cc_edit, neop, EDIT_CC_COLOR)
+    
+    if pressed_buttons and not combo_pressed:
+        if pressed_buttons[0][1] != 0:
+            axis = 2 - pressed_buttons[0][0]
+            if 0 <= axis < 3:
+                axis_modes[axis] = handle_select_mode(pressed_buttons[0][1])
+                row_off(cc_edit, pressed_buttons[0][0])
+                handle_cc_lights(pressed_buttons, cc_edit, pressed_buttons[0][0])
+                reset_colors(cc_edit, neop, EDIT_CC_COLOR)
+    
+    if len(pressed_buttons) > 2:
+        handler = find_combo(pressed_buttons, CC_EDIT_COMBOS, {})
+        if handler: handler(pressed_buttons)
+        else: print(pressed_buttons)
+    if not pressed_buttons:
+        combo_pressed = False
+
+def select_slot_mode(pressed_buttons):
+    global current_slot, last_step, axis_modes, mode, combo_pressed
+    slots = get_slots()
+    light_slots(slots, SAVE_SLOT_COLOR, neop)
+    neop[current_slot] = CURRENT_SLOT_COLOR
+        
+    if pressed_buttons and not combo_pressed and press_to_light(pressed_buttons[0]) < len(slots):
+        chain.store(save_queue)
+        chain.clear()
+        journal.begin(grids, journal_state())
+        materialize()
+        save_queue.put(current_slot, grids, last_step, axis_modes)
+        current_slot = press_to_light(pressed_buttons[0])
+        if save_queue.holds(current_slot) and current_slot not in slot_cache: save_queue.flush()
+        [ _, _, last_step, axis_modes ] = read_save(current_slot, notes, shift)
+        schedule.compile(last_step)
+        journal.end(grids, journal_state())
+        mode = b'm'
+        combo_pressed = True
+        
+    if not pressed_buttons:
+        combo_pressed = False
+
+def delete_slot_mode(pressed_buttons):
+    global mode, combo_pressed
+    slots = get_slots()
+    if any(slots): light_slots(slots, DELETE_SLOT_COLOR, neop)
+    else: mode = b'm'
+        
+    slot = press_to_light(pressed_buttons[0]) if pressed_buttons else len(slots)
+    if pressed_buttons and not combo_pressed and slot < len(slots) and slots[slot]:
+        chain.store(save_queue)
+        chain.clear()
+        save_queue.flush()
+        delete_slot(slot)
+        mode = b'm'
+        combo_pressed = True
+        
+    if not pressed_buttons:
+        combo_pressed = False
+
+def delete_all_slots_mode(pressed_buttons):
+    global current_slot, rotation, mode, combo_pressed
+    fill_yes_no(CONFIRM_COLOR, DECLINE_COLOR, neop)
+    
+    if pressed_buttons and not combo_pressed:
+        if press_to_light(pressed_buttons[0]) < len(neop) // 2:
+            chain.store(save_queue)
+            chain.clear()
+            save_queue.flush()
+            journal.begin(grids, journal_state())
+            delete_all_slots()
+            current_slot = 0
+            rotation = 0
+            clear_grid(notes)
+            clear_grid(shift)
+            journal.end(grids, journal_state())
+        mode = b'm'
+        combo_pressed = True
+        
+    if not pressed_buttons:
+        combo_pressed = False
+
+def chain_mode(pressed_buttons):
+    global mode, combo_pressed
+    slots = get_slots()
+    light_slots(slots, SAVE_SLOT_COLOR, neop)
+    for slot, loops in chain.entries: neop[slot] = CHAIN_SLOT_COLOR
+
+    if pressed_buttons and not combo_pressed:
+        slot = press_to_light(pressed_buttons[0])
+        if slot < len(slots) and slots[slot]: chain.add(slot)
+        else: mode = b'm' # an empty slot starts the chain, or turns it off if nothing was added
+        combo_pressed = True
+
+    if not pressed_buttons:
+        combo_pressed = False
+
+MODES = {
+    b'm':  main_mode,
+    b's':  main_mode,
+    b'c':  edit_cc_mode,
+    b'p':  select_slot_mode,
+    b'd':  delete_slot_mode,
+    b'da': delete_all_slots_mode,
+    b'ch': chain_mode,
+}
+
+"""
+======== SysEx Handlers ========
+"""
+
+def heap_command(message):
+    heap.enable(not heap.enabled)
+    print("heap instrumentation", "on" if heap.enabled else "off")
+
+def heap_dump_command(message):
+    heap.dump()
+    midi_out.sysex(SYSEX_ID, bytes((SYSEX_HEAP_DUMP,)) + heap.report())
+
+def profile_command(message):
+    profile.dump()
+    print("clock:", CLOCK_NAMES[clock.mode], clock.tempo(), "bpm")
+    midi_out.sysex(SYSEX_ID, bytes((SYSEX_PROFILE,)) + profile.report())
+
+SYSEX_COMMANDS = {
+    SYSEX_HEAP:      heap_command,
+    SYSEX_HEAP_DUMP: heap_dump_command,
+    SYSEX_PROFILE:   profile_command,
+}
+
+"""
+======== Transport ========
+"""
+
+def play_tick():
+    global ticks, loop_tick, eighth_note, lit_step
+    if loop_tick >= schedule.length:
+        loop_tick = 0
+        if stream.active(): next_measure()
+        elif chain.advance(current_slot): swap_chain()
+    for grid, step in schedule.at(loop_tick):
+        release_notes(sounding[grid], midi_out)
+        sounding[grid] = play_column(grids[grid], stored_column(step, rotation, last_step) + column_base, midi_out)
+        if mode == GRID_MODES[grid] and not combo_pressed:
+            col_clr, on_clr, acct_clr = GRID_COLORS[grid]
+            lit_step = move_column(step + column_base, lit_step, grids[grid], col_clr, on_clr, acct_clr, neop, NOTE_OFF, row_offset, column_offset, rotation, last_step)
+    if loop_tick % TICKS_PER_STEP == 0 and recorder.count: recorder.ready = True
+    if ticks % TICKS_PER_STEP == 0:
+        eighth_note += 1
+    ticks += 1
+    loop_tick += 1
+
+def start(now):
+    global ticks, loop_tick, eighth_note
+    clock.start(now)
+    profile.reset()
+    ticks = 0
+    loop_tick = 0
+    eighth_note = 0
+
+def stop():
+    clock.stop()
+    if recorder.count: recorder.commit(GRID_OFFSETS, record_hit)
+    for grid in grids: stop_notes(grid, midi_out)
+    for grid in range(len(grids)): sounding[grid] = b''
+    midi_out.flush()
+    save_queue.flush()
+    if mode in GRID_MODES: redraw()
+    if midi_in.late_ticks:
+        print("late ticks:", midi_in.late_ticks)
+        midi_in.late_ticks = 0
+    if heap.enabled: heap.dump()
+
 reset_colors(notes, neop, NOTE_ON)
 
 while True:
+    heap.begin()
+    profile.begin(ticks_ms())
 
     """
     ======== Play Sequence ========
@@ -84,346 +660,89 @@ while True:
     """
     Receive MIDI
     """
-    new_message = receive()
-    if new_message != old_message and new_message != None:
+    midi_in.drain()
+    now = ticks_ms()
+    if midi_in.clocks and clock.mode == CLOCK_EXTERNAL: profile.clock(now, midi_in.clocks)
+    for i in range(midi_in.count):
+        new_message = midi_in.realtime[i]
 
         """
         Sync To TimingClock
         """
-        if isinstance(new_message, TimingClock):
-            """
-            Main Grid
-            """
-            if ticks % 12 == 0:
-                for i in range(NUMBER_OF_COLUMNS):
-                    if eighth_note % last_step + 1 == i:
-                        stop_column(notes, i-2, NoteOff)
-                        play_column(notes, i-1, NoteOn, NoteOff)
-                        if mode == b'm':
-                            move_column(i, notes, last_step, COLUMN_COLOR, NOTE_ON, ACCENT, neop, NOTE_OFF, row_offset, column_offset)
-                eighth_note += 1           
-            """
-            Shift Grid
-            """
-            if ticks % 12 == 7: #TODO add shift here - should be change-able and save-able or a three grid thing
-                for i in range(NUMBER_OF_COLUMNS):
-                    if eighth_note % last_step == i:
-                        stop_column(shift, i-2, NoteOff)
-                        play_column(shift, i-1, NoteOn, NoteOff)
-                        if mode == b's':
-                            move_column(i, shift, last_step, SHIFT_COLUMN_COLOR, SHIFT_NOTE_ON, SHIFT_ACCENT, neop, NOTE_OFF, row_offset, column_offset)
-                        
-            ticks += 1
+        if isinstance(new_message, TimingClock) and clock.received(now):
+            play_tick()
             
         """
         Start and Stop
         """
-        if isinstance(new_message, Start):
-            ticks = 0
-            eighth_note = 0
+        if isinstance(new_message, Start) and clock.mode != CLOCK_INTERNAL:
+            start(now)
             
-        if isinstance(new_message, Stop):
-            reset_colors(notes, neop, NOTE_ON, NOTE_OFF, row_offset, column_offset)
-            stop_notes(notes, NoteOff)
+        if isinstance(new_message, Stop) and clock.mode != CLOCK_INTERNAL:
+            stop()
 
-            
-    old_message = new_message
+    """
+    Internal Clock
+    """
+    now = ticks_ms()
+    due = clock.due(now)
+    if due: profile.clock(now, due)
+    for i in range(due): play_tick()
+
+    """
+    SysEx Commands
+    """
+    for message in midi_in.commands:
+        if message.manufacturer_id == SYSEX_ID and message.data:
+            handler = SYSEX_COMMANDS.get(message.data[0])
+            if handler: handler(message)
+    midi_out.flush()
+
+    """
+    Commit Recorded Hits
+    """
+    if recorder.ready: recorder.commit(GRID_OFFSETS, record_hit)
+    heap.mark(SECTION_CLOCK)
+    profile.mark(SECTION_CLOCK, ticks_ms())
     
     """
     ======== Read Buttons ========
     """
     
     pressed_buttons = trellis.pressed_keys
+    heap.mark(SECTION_KEYS)
+    profile.mark(SECTION_KEYS, ticks_ms())
     
     if pressed_buttons != last_press:
-        """
-        Main Mode
-        """
-        if mode == b'm' or mode == b's':
-            if pressed_buttons and not combo_pressed:
-                for note in notes.grid[pressed_buttons[0][1] + column_offset] if mode == b'm' else shift.grid[pressed_buttons[0][1] + column_offset]:
-                    if note.note == pressed_buttons[0][0] + STARTING_NOTE + row_offset:
-                        tick_placeholder = ticks
-                        held_note = note
-                        button_is_held = True
-                        
-            elif button_is_held:
-                if ticks - tick_placeholder < HOLD_TIME:
-                    if mode == b'm':
-                        neop[held_note.index] = NOTE_ON if not held_note.is_on else NOTE_OFF
-                    elif mode == b's':
-                        neop[held_note.index] = SHIFT_NOTE_ON if not held_note.is_on else NOTE_OFF
-                    held_note.toggle() #TODO something is slow here - there is a slight delay when a new note is added
-                    if held_note.is_accented:
-                        held_note.toggle_accent()
-                    button_is_held = False
-                else:
-                    if not held_note.is_on:
-                        if mode == b'm':
-                            neop[held_note.index] = ACCENT if not held_note.is_accented else NOTE_OFF
-                        elif mode == b's':
-                            neop[held_note.index] = SHIFT_NOTE_ON if not held_note.is_on else NOTE_OFF
-                        held_note.toggle()
-                    held_note.toggle_accent()
-            if not pressed_buttons:
-                combo_pressed = False
-            
-            """
-            Main Combos
-            """
-            if len(pressed_buttons) > 1:
-                combo_pressed = True
-                if pressed_buttons == CLEAR_COMBO:
-                    clear_grid(notes)
-                    clear_grid(shift)
-                    reset_colors(notes, neop, NOTE_ON, NOTE_OFF, row_offset, column_offset)
-                    
-                elif pressed_buttons == SHIFT_MODE_COMBO:
-                    reset_colors(shift if mode == b'm' else notes, neop, NOTE_ON if mode == b's' else SHIFT_NOTE_ON, NOTE_OFF, row_offset, column_offset)
-                    mode = b's' if mode == b'm' else b'm'
-                
-                elif pressed_buttons == EDIT_CC_COMBO:
-                    mode = b'c'
-                    reset_colors(cc_edit, neop, EDIT_CC_COLOR, NOTE_OFF, row_offset, column_offset)
-                    
-                elif pressed_buttons == SELECT_SLOT_MODE:
-                    mode = b'p'
-                    fill(NOTE_OFF)
-                    
-                elif pressed_buttons == DELETE_SLOT_MODE:
-                    mode = b'd'
-                    fill(NOTE_OFF)
-                    
-                elif pressed_buttons == DELETE_ALL_SLOTS_MODE:
-                    mode = b'da'
-                    fill(NOTE_OFF)
-                
-                elif pressed_buttons[-2:] == OFFSET_CHANGE_MODE_COMBO: #FEAT light up available buttons
-                    if len(pressed_buttons) > 2:
-                        if pressed_buttons[0] == CHANGE_OFFSET[0]:
-                            row_offset = increase_row_offset(row_offset, NUMBER_OF_ROWS)
-                            reset_colors(notes if mode == b'm' else shift, neop, NOTE_ON if mode == b'm' else SHIFT_NOTE_ON, NOTE_OFF, row_offset, column_offset)
-                            
-                        elif pressed_buttons[0] == CHANGE_OFFSET[1]:
-                            row_offset = decrease_row_offset(row_offset)
-                            reset_colors(notes if mode == b'm' else shift, neop, NOTE_ON if mode == b'm' else SHIFT_NOTE_ON, NOTE_OFF, row_offset, column_offset)
-                            
-                        elif pressed_buttons[0] == CHANGE_OFFSET[2]:
-                            column_offset = increase_column_offset(column_offset, NUMBER_OF_COLUMNS)
-                            reset_colors(notes if mode == b'm' else shift, neop, NOTE_ON if mode == b'm' else SHIFT_NOTE_ON, NOTE_OFF, row_offset, column_offset)
-                            
-                        elif pressed_buttons[0] == CHANGE_OFFSET[3]:
-                            column_offset = decrease_column_offset(column_offset)
-                            reset_colors(notes if mode == b'm' else shift, neop, NOTE_ON if mode == b'm' else SHIFT_NOTE_ON, NOTE_OFF, row_offset, column_offset)
-                    
-                elif pressed_buttons[-2:] == MANUAL_CC_COMBO:
-                    for cc in toggled_cc:
-                        neop[press_to_light(cc[1])] = MANUAL_CC_COLOR
-                    if len(pressed_buttons) > 2:
-                        manual_cc = []
-                        for button in pressed_buttons:
-                            if button == MANUAL_CC_COMBO[0] or button == MANUAL_CC_COMBO[1]:
-                                pass
-                            else:
-                                manual_cc.append((MANUAL_CC[button[0]][button[1]], button))
-                    else:
-                        manual_cc = []
-                    for cc in manual_cc:
-                        if cc not in prev_manual_cc:
-                            if cc[1][0] <= 1:
-                                midi.send(ControlChange(cc[0], 127))
-                                neop[press_to_light(cc[1])] = MANUAL_CC_COLOR
-                            if cc[1][0] >= 2:
-                                if cc not in toggled_cc:
-                                    toggled_cc.append(cc)
-                                    midi.send(ControlChange(cc[0], 127))
-                                    neop[press_to_light(cc[1])] = MANUAL_CC_COLOR
-                                else:
-                                    toggled_cc.remove(cc)
-                                    midi.send(ControlChange(cc[0], 0))
-                                    neop[press_to_light(cc[1])] = NOTE_OFF
-                    for cc in prev_manual_cc:
-                        if cc not in manual_cc:
-                            if cc[1][0] <=1:
-                                midi.send(ControlChange(cc[0], 0))
-                                neop[press_to_light(cc[1])] = NOTE_OFF
-                    prev_manual_cc = manual_cc
-                    
-                elif pressed_buttons[-2:] == MANUAL_NOTE_COMBO: 
-                    if len(pressed_buttons) > 2:
-                        manual_notes = []
-                        for button in pressed_buttons:
-                            if button == MANUAL_NOTE_COMBO[0] or button == MANUAL_NOTE_COMBO[1]:
-                                pass
-                            else:
-                                manual_notes.append((MANUAL_NOTES[button[0]][button[1]], button))
-                    else:
-                        manual_notes = []
-                    for note in manual_notes:
-                        if note not in prev_manual_notes:
-                            midi.send(NoteOn(note[0], 127), channel=1 if separate_manual_note_channel else 0)
-                            neop[press_to_light(note[1])] = MANUAL_NOTE_COLOR_ALT if separate_manual_note_channel else MANUAL_NOTE_COLOR
-                    for note in prev_manual_notes:
-                        if note not in manual_notes:
-                            midi.send(NoteOff(note[0], 0), channel=1 if separate_manual_note_channel else 0)
-                            neop[press_to_light(note[1])] = NOTE_OFF
-                    prev_manual_notes = manual_notes
-                    
-                elif pressed_buttons[-2:] == RECORD_NOTE_COMBO: 
-                    if len(pressed_buttons) > 2:
-                        manual_notes = []
-                        for button in pressed_buttons:
-                            if button == RECORD_NOTE_COMBO[0] or button == RECORD_NOTE_COMBO[1]:
-                                pass
-                            elif button[1] > 3: pass
-                            else:
-                                manual_notes.append((MANUAL_NOTES[button[0]][button[1]], button)) #ERROR if button pressed in on second half for board
-                    else:
-                        manual_notes = []
-                    for note in manual_notes:
-                        if note not in prev_manual_notes:
-                            column_now = ticks%(last_step*12)/6
-                            if round(column_now) % 2 == 0:
-                                for grid_note in notes.grid[floor(column_now/2)]:
-                                    if grid_note.note == note[0]:
-                                        grid_note.is_on = True
-                            else:
-                                for grid_note in shift.grid[floor(column_now/2)]:
-                                    if grid_note.note == note[0]:
-                                        grid_note.is_on = True
-                            if round(column_now) - column_now < 0:
-                                midi.send(NoteOn(note[0], 127))
-                            neop[press_to_light(note[1])] = RECORD_NOTE_COLOR
-                    for note in prev_manual_notes:
-                        if note not in manual_notes:
-                            midi.send(NoteOff(note[0], 0))
-                            neop[press_to_light(note[1])] = NOTE_OFF
-                    prev_manual_notes = manual_notes
-                
-                elif pressed_buttons == CHANGE_MANUAL_NOTE_CHANNEL_COMBO:
-                    separate_manual_note_channel = False if separate_manual_note_channel else True
-                
-                elif pressed_buttons[-2:] == PATTERN_SHIFT_MODE_COMBO:
-                    light_buttons(PATTERN_SHIFT_BUTTONS, PATTERN_SHIFT_COLOR, neop) #BUG lights are not resetting after release and are reset by column while held
-                    if len(pressed_buttons) > 2:
-                        if pressed_buttons[0] == PATTERN_SHIFT_BUTTONS[0]:
-                            notes = shift_grid_left(notes)
-                            shift = shift_grid_left(shift)
-                            reset_colors(notes if mode == b'm' else shift, neop, NOTE_ON if mode == b'm' else SHIFT_NOTE_ON, NOTE_OFF, row_offset, column_offset)
-                        elif pressed_buttons[0] == PATTERN_SHIFT_BUTTONS[1]:
-                            notes = shift_grid_right(notes)
-                            shift = shift_grid_right(shift)
-                            reset_colors(notes if mode == b'm' else shift, neop, NOTE_ON if mode == b'm' else SHIFT_NOTE_ON, NOTE_OFF, row_offset, column_offset)
-                
-                elif pressed_buttons[-2:] == LAST_STEP_EDIT_COMBO:
-                    light_buttons(LAST_STEP_BUTTONS, LAST_STEP_COLOR, neop)
-                    if len(pressed_buttons) > 2:
-                        last_step = handle_last_step_edit(last_step, pressed_buttons[0], LAST_STEP_BUTTONS, NUMBER_OF_COLUMNS)
-                        if pressed_buttons[0] == LAST_STEP_BUTTONS[3]:
-                            [notes.grid, shift.grid] = duplicate_measure((notes.grid, shift.grid))
-                        
-                else:
-                    print(pressed_buttons)
-                    
-                button_is_held = False
-                
-                """
-                Edit CC Mode
-                """
-        elif mode == b'c':
-            handle_cc_grid(cc_edit, axis_modes, 2)
-            reset_colors(cc_edit, neop, EDIT_CC_COLOR)
-            
-            if pressed_buttons and not combo_pressed:
-                
-                if pressed_buttons[0][1] == 0:
-                    pass
-                
-                elif pressed_buttons[0][0] == 2:
-                    axis_modes[0] = handle_select_mode(pressed_buttons[0][1])
-                    row_off(cc_edit, 2)
-                    handle_cc_lights(pressed_buttons, cc_edit, 2)
-                    reset_colors(cc_edit, neop, EDIT_CC_COLOR)
-
-                elif pressed_buttons[0][0] == 1:
-                    axis_modes[1] = handle_select_mode(pressed_buttons[0][1])
-                    row_off(cc_edit, 1)
-                    handle_cc_lights(pressed_buttons, cc_edit, 1)
-                    reset_colors(cc_edit, neop, EDIT_CC_COLOR)
-                    
-                elif pressed_buttons[0][0] == 0:
-                    axis_modes[2] = handle_select_mode(pressed_buttons[0][1])
-                    row_off(cc_edit, 0)
-                    handle_cc_lights(pressed_buttons, cc_edit, 0)
-                    reset_colors(cc_edit, neop, EDIT_CC_COLOR)
-            
-            """
-            Edit CC Combos
-            """
-            if len(pressed_buttons) > 2:
-                if pressed_buttons == EDIT_CC_COMBO:
-                    mode = b'm'
-                    reset_colors(notes, neop, NOTE_ON, NOTE_OFF, row_offset, column_offset)
-                else:
-                    print(pressed_buttons)
-            if not pressed_buttons:
-                combo_pressed = False
-                
-            """
-            Pattern Select Mode
-            """
-        elif mode == b'p':
-            slots = get_slots()
-            light_slots(slots, SAVE_SLOT_COLOR, neop)
-            neop[current_slot] = CURRENT_SLOT_COLOR
-                
-            if pressed_buttons and not combo_pressed:
-                write_save(notes, shift, last_step, axis_modes)
-                current_slot = press_to_light(pressed_buttons[0])
-                [ notes, shift, last_step, axis_modes ] = read_save(current_slot, notes, shift)
-                mode = b'm'
-                
-            if not pressed_buttons:
-                combo_pressed = False
-        
-            """
-            Pattern Delete Mode
-            """
-        elif mode == b'd':
-            slots = get_slots()
-            if slots: light_slots(slots, DELETE_SLOT_COLOR, neop)
-            else: mode = b'm'
-                
-            if pressed_buttons and not combo_pressed and press_to_light(pressed_buttons[0]) in slots:
-                remove("/{}.json".format(press_to_light(pressed_buttons[0])))
-                mode = b'm'
-                
-            if not pressed_buttons:
-                combo_pressed = False
-        
-            """
-            Delete All Pattern Mode
-            """
-        elif mode == b'da':
-            fill_yes_no(CONFIRM_COLOR, DECLINE_COLOR, neop)
-            
-            if pressed_buttons and not combo_pressed:
-                if press_to_light(pressed_buttons[0]) < 16:
-                    delete_all_slots()
-                    current_slot = 0
-                    clear_grid(notes)
-                    clear_grid(shift)
-                mode = b'm'
-                
-            if not pressed_buttons:
-                combo_pressed = False
+        MODES[mode](pressed_buttons)
+        if song_request != (current_slot, mode): song_request = None # only the pattern the combo was pressed on becomes the song
             
     last_press = pressed_buttons
+    heap.mark(SECTION_COMBOS)
+    profile.mark(SECTION_COMBOS, ticks_ms())
 
     """
     ======== Send Axes CC ========
     """
-    if ticks != last_tick:
-        handle_axes(axis_modes, accelerometer.acceleration, AXIS_CCS, ControlChange, midi)
-    
-    last_tick = ticks
\ No newline at end of file
+    axes.update(ticks_ms(), axis_modes, midi_out.control_change)
+    midi_out.flush()
+    heap.mark(SECTION_AXES)
+    profile.mark(SECTION_AXES, ticks_ms())
+
+    """
+    ======== Update LEDs ========
+    """
+    neop.flush()
+    heap.mark(SECTION_LEDS)
+    profile.mark(SECTION_LEDS, ticks_ms())
+
+    """
+    ======== Write Pending Save ========
+    """
+    if not midi_in.count and not midi_in.commands and clock.spare(ticks_ms()) >= CLOCK_SPARE_MS:
+        chain.prefetch(current_slot, save_queue)
+        if stream.building is not None and stream.build() and song_request == (current_slot, mode): enter_song()
+        stream.prefetch()
+        save_queue.step()
+    heap.mark(SECTION_SAVE)
+    profile.mark(SECTION_SAVE, ticks_ms())
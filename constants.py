@@ -16,6 +16,7 @@ EDIT_CC_COLOR          = ( 191, 191, 255 )
 MANUAL_NOTE_COLOR      = (   0, 255,   0 )
 MANUAL_NOTE_COLOR_ALT  = (   0, 191, 191 )
 RECORD_NOTE_COLOR      = ( 255,   0,   0 )
+RECORD_SETTING_COLOR   = (  63,   0,   0 )
 MANUAL_CC_COLOR        = (   0, 255,  63 )
 CURRENT_SLOT_COLOR     = (  11, 255,  11 )
 SAVE_SLOT_COLOR        = ( 191, 191,  11 )
@@ -24,13 +25,29 @@ CONFIRM_COLOR          = (   0, 255,   0 )
 DECLINE_COLOR          = ( 255,   0,   0 )
 LAST_STEP_COLOR        = ( 255,  11, 191 )
 PATTERN_SHIFT_COLOR    = ( 255,  11,  11 )
+CLOCK_COLOR            = ( 255, 127,   0 )
+CHAIN_SLOT_COLOR       = (  11, 191, 255 )
 
 """
 Grid Parameters
 """
 STARTING_NOTE     = const(36)
-NUMBER_OF_COLUMNS = const(17)
-NUMBER_OF_ROWS    = const(12) #TODO should be 16, but there are still memory allocation errors
+NUMBER_OF_COLUMNS = const(33)
+NUMBER_OF_ROWS    = const(16)
+TICKS_PER_STEP    = const(12) # 24 PPQN clock, eighth note steps
+GRID_OFFSETS      = ( 0, 7 ) # in ticks - main grid, shift grid
+GRID_MODES        = ( b'm', b's' )
+GRID_COLORS       = ( ( COLUMN_COLOR, NOTE_ON, ACCENT ),
+                      ( SHIFT_COLUMN_COLOR, SHIFT_NOTE_ON, SHIFT_ACCENT ) )
+
+"""
+Surface
+"""
+BOARD_ROWS    = const(4)
+BOARD_COLUMNS = const(8)
+BOARDS        = ( ( 0, 0, False ), ) # column, row in boards and whether it is mounted upside down, in the order their pixels are chained
+                                     # boards stack in column 0, as the drawing code shows 8 steps at a time
+                                     # only the keys and pixels of the Trellis running the code are driven, other boards are mapped but not read or lit
 
 """
 Button Combonations
@@ -51,29 +68,120 @@ LAST_STEP_BUTTONS                = ((1, 3), (1, 4), (1, 5), (1, 6))
 SELECT_SLOT_MODE                 = [(3, 0), (0, 0), (3, 4)]
 DELETE_SLOT_MODE                 = [(3, 0), (0, 0), (2, 4)]
 DELETE_ALL_SLOTS_MODE            = [(3, 0), (0, 0), (1, 4)]
+UNDO_COMBO                       = [(3, 0), (0, 0), (2, 1)]
+REDO_COMBO                       = [(3, 0), (0, 0), (2, 2)]
+CHAIN_MODE                       = [(3, 0), (0, 0), (3, 5)]
+PROFILE_COMBO                    = [(3, 0), (0, 0), (2, 5)]
+SONG_MODE                        = [(3, 0), (0, 0), (1, 5)]
+CLOCK_COMBO                      = [(1, 7), (0, 7)]
+CLOCK_BUTTONS                    = ((2, 3), (2, 4), (1, 3), (1, 4), (1, 5), (1, 6))
+ROUTE_COMBO                      = [(2, 6), (0, 6)]
+ROUTE_COLUMNS                    = (2, 3, 4, 5) # channel down, channel up, note down, note up for the row pressed
+RECORD_BUTTONS                   = ((3, 4), (2, 4), (1, 4), (0, 4)) # one per entry of RECORD_TARGETS, then the strength
 
 """
 Integers
 """
-HOLD_TIME = const(24) #in ticks
+HOLD_TIME       = const(24) #in ticks
+NOTE_VELOCITY   = const(96)
+ACCENT_VELOCITY = const(127)
+SAVE_CHUNK      = const(64) #bytes written to flash per loop
+MIDI_DRAIN      = const(32) #most MIDI messages read per loop
+MIDI_OUT_BUFFER = const(256) #bytes of MIDI written at once
+SLOT_CACHE_MAX  = const(8) #most decoded slots kept in RAM
+SLOT_CACHE_HEAP = const(8) #cache uses at most 1/n of the free heap
+RECORD_RING     = const(16) #most recorded hits waiting for a step boundary
+JOURNAL_SIZE    = const(128) #most column diffs kept for undo, about 10 bytes each
+
+"""
+Clock
+"""
+CLOCK_EXTERNAL  = const(0) # play incoming clocks as they arrive
+CLOCK_INTERNAL  = const(1) # play and send clocks at CLOCK_BPM
+CLOCK_FOLLOW    = const(2) # play and send clocks at the tempo of the incoming ones
+CLOCK_NAMES     = ( 'external', 'internal', 'follow' )
+CLOCK_BPM       = const(120)
+CLOCK_TEMPI     = ( 30, 300 )
+CLOCK_CATCH_UP  = const(2) # most ticks played in one loop when running late
+CLOCK_SMOOTHING = const(3) # shift of the tempo average when following
+CLOCK_SPARE_MS  = const(4) # a pending save only runs with this long until the next tick
+
+"""
+Record
+"""
+RECORD_TARGETS   = ( ( 0, 1 ), ( 0, ), ( 1, ) ) # entries of GRID_OFFSETS a recorded hit may land on
+RECORD_STRENGTHS = ( 0, 50, 75, 100 ) # percent a hit is pulled toward the main grid before landing
+
+"""
+Journal
+"""
+JOURNAL_BEGIN = const(0x8000) # set on the first diff of an action
+JOURNAL_STATE = const(0x7F) # grid of a diff holding rotation, last step, slot and axis modes
+JOURNAL_ROUTE = const(0x40) # set on the column of a diff holding the note and channel of a row
 
 """
 Axis CCs
 """
-AXIS_CCS = (3, 9, 14, 15, 20, 21)
+AXIS_CCS       = (3, 9, 14, 15, 20, 21)
+AXIS_ORDER     = (1, 0, 2) # accelerometer axis read for each entry of axis_modes
+AXIS_SAMPLE_MS = const(20)
+AXIS_SMOOTHING = const(2) # shift of the running average, higher is smoother
+AXIS_THRESHOLD = const(2) # smallest change of a CC value that is sent
+AXIS_CC_BUDGET = const(60) # most axis CCs sent per second
+TICKS_PERIOD   = const(1 << 29) # supervisor.ticks_ms wraps here
 
 """
-Lists
+Loop Sections
 """
-CORRECT_INDEX  =  ( 24, 16,  8, 0,
-                    25, 17,  9, 1,
-                    26, 18, 10, 2,
-                    27, 19, 11, 3,
-                    28, 20, 12, 4,
-                    29, 21, 13, 5,
-                    30, 22, 14, 6,
-                    31, 23, 15, 7 )
+SECTION_CLOCK   = const(0)
+SECTION_KEYS    = const(1)
+SECTION_COMBOS  = const(2)
+SECTION_AXES    = const(3)
+SECTION_LEDS    = const(4)
+SECTION_SAVE    = const(5)
+SECTION_NAMES   = ( 'clock', 'keys', 'combos', 'axes', 'leds', 'save' )
+HEAP_BUDGETS    = ( 256, 256, 2048, 128, 64, 1024 ) # bytes per pass
+PROFILE_BUCKETS = const(16) # 1 ms each, the last one counts everything longer
 
+"""
+SysEx
+"""
+SYSEX_ID        = b'\x7d' # non-commercial manufacturer id
+SYSEX_HEAP      = const(1) # toggle heap instrumentation
+SYSEX_HEAP_DUMP = const(2) # print the heap report and send it back
+SYSEX_PROFILE   = const(3) # print the timing report and send it back
+
+"""
+Slot Format
+"""
+SLOT_MAGIC   = b'DS'
+SLOT_VERSION = const(3)
+SLOT_HEADER  = const(10) # magic, version, rows, columns, last step, 3 axis modes, grid count
+SLOT_MEASURES = const((NUMBER_OF_COLUMNS + 7) // 8)
+SLOT_SIZE    = const(SLOT_HEADER + 2 * (2 * NUMBER_OF_ROWS + 1 + SLOT_MEASURES * 33) + 2) # header, per grid row routing, measure map and 32 byte measures, checksum
+AXIS_MODES   = ( None, b'd', b'f', b's', b'o', b'fo', b'so' )
+
+SAVE_LOG_MAGIC  = b'DJ' # a save in progress, kept beside the slot as /n.jnl
+SAVE_LOG_COMMIT = b'OK' # last bytes of a complete log
+SAVE_LOG_HEADER = const(6) # magic, whole file, region count, file size, then start and end of every region
+SAVE_DIRECT     = const(0) # phases of a save - a new slot file is written as it is
+SAVE_LOG        = const(1) # the regions that changed are written to the log
+SAVE_APPLY      = const(2) # then into the slot file in place
+
+"""
+Song Format
+"""
+SONG_PATH     = '/song.bin'
+SONG_MAGIC    = b'DG'
+SONG_VERSION  = const(1)
+SONG_HEADER   = const(8) # magic, version, rows, measure count (2), grid count, unused
+SONG_CHUNK    = const(2 * 2 * 8 * 2) # one measure: on and accent words of 8 columns per grid
+SONG_MEASURES = const(128) # measures in a new song
+SONG_RING     = const(4) # measures held in RAM, the playing one and those read ahead
+
+"""
+Lists
+"""
 MANUAL_NOTES      = ( ( 48, 44, 40, 36 ),
                       ( 49, 45, 41, 37 ),
                       ( 50, 46, 42, 38 ),
@@ -1,112 +1,120 @@
+from json import loads
+from os import listdir
+from os import remove
+from os import stat
+from errno import ENOENT
+try:
+    from gc import mem_alloc, mem_free
+except ImportError:
+    mem_alloc = mem_free = None
+
+from constants import *
+from geometry import *
+
+slot_buffer = bytearray(SLOT_SIZE) # reused by every save and load
+slot_index = bytearray(32) # 1 for every slot saved on flash
+slots_stale = True
+slot_cache = {} # slot -> encoded pattern, mirrors what is saved on flash
+cache_order = [] # cached slots, least recently used first
+cache_size = min(SLOT_CACHE_MAX, mem_free() // SLOT_CACHE_HEAP // SLOT_SIZE) if mem_free else SLOT_CACHE_MAX
 
 """
 ======== Functions ========
 """
-def reset_colors(nts, np, on, off=(0, 0, 0), row_offs=0, col_offs=0):
-    for col in nts.grid[col_offs:col_offs+8]:
-        for nt in col[row_offs:row_offs+4]:
-            np[nt.index] = on if nt.is_on else off
+def reset_colors(nts, np, on, off=(0, 0, 0), row_offs=0, col_offs=0, rot=0, lst_stp=0):
+    for col in range(col_offs, col_offs + surface.width):
+        bits = nts.bits(stored_column(col, rot, lst_stp)) >> row_offs
+        for row in range(surface.height):
+            np[cell_pixel(col, row)] = on if bits >> row & 1 else off
 
 def light_buttons(bts, clr, np): 
     for bt in bts:
         np[press_to_light(bt)] = clr
 
 def light_column(col, col_clr, np):
-    for i in range(4): np[ col + (i*8) ] = col_clr
+    for row in range(surface.height): np[cell_pixel(col, row)] = col_clr
     
-def reset_column(nts, offs, col, on, off, acct, np):
-    for nt in nts.grid[col][offs:offs+4]:
-        np[nt.index] = acct if nt.is_accented else on if nt.is_on else off
-
-def play_column(nts, col, note_on, note_off):
-    col = tuple(nts.grid[col])
-    r = range(len(col))
-    for i in r: col[i].play(note_on, note_off)
+def reset_column(nts, offs, col, on, off, acct, np, rot=0, lst_stp=0):
+    src = stored_column(col, rot, lst_stp)
+    bits, acct_bits = nts.bits(src) >> offs, nts.accents(src) >> offs
+    for row in range(surface.height):
+        np[cell_pixel(col, row)] = acct if acct_bits >> row & 1 else on if bits >> row & 1 else off
+
+def play_column(nts, col, out):
+    evts = nts.events(col)
+    r = range(0, len(evts), 3)
+    for i in r:
+        out.note_off(evts[i+1], evts[i])
+        out.note_on(evts[i+1], evts[i+2], evts[i])
+    return evts
         
-def stop_column(nts, col, note_off):
-    col = tuple(nts.grid[col])
-    r = range(len(col))
-    for i in r: col[i].stop(note_off)
-
-def move_column(i, grd, lst_stp, col_clr, on, acct, np, off=(0, 0, 0), row_offs=0, col_offs=0):
-    if i % 8 == 0:
-        if col_offs == lst_stp+1 - 8:
-            if i == 0:
-                light_column(7, col_clr, np)
-                reset_column(grd, row_offs, 6, on, off, acct, np) #BUG last column hangs up in shift mode
-            
-        else:
-            if col_offs < i <= col_offs + 8:
-                light_column(7, col_clr, np)
-                reset_column(grd, row_offs, col_offs + 6, on, off, acct, np)
-    else:
-        if i % 8 == 1:
-            reset_column(grd, row_offs, col_offs + 7, on, off, acct, np)
-            
-        if col_offs <= i < col_offs + 8:
-            light_column((i-1)%8, col_clr, np)
-            reset_column(grd, row_offs, (i-2), on, off, acct, np)
-            
-    if i == 1:
-        reset_column(grd, row_offs, col_offs + 7, on, off, acct, np)
-        reset_column(grd, row_offs, (lst_stp-1)%8, on, off, acct, np)
+def release_notes(evts, out):
+    r = range(0, len(evts), 3)
+    for i in r: out.note_off(evts[i+1], evts[i])
+
+def move_column(step, lit_step, grd, col_clr, on, acct, np, off=(0, 0, 0), row_offs=0, col_offs=0, rot=0, lst_stp=0):
+    if lit_step is not None and col_offs <= lit_step < col_offs + surface.width:
+        reset_column(grd, row_offs, lit_step, on, off, acct, np, rot, lst_stp)
+    if col_offs <= step < col_offs + surface.width:
+        light_column(step, col_clr, np)
+    return step
 
-def stop_notes(notes, note_off):
-    map(lambda x: map(lambda y: y.stop(note_off), x), notes.grid)
+def stop_notes(notes, out):
+    for i in notes.order: out.note_off(notes.notes[i], notes.channels[i])
 
 def clear_grid(notes):
-    for column in notes.grid:
-        for note in column: note.is_on = False
+    notes.clear()
             
 def scale(val, src, dst):
-    output = ((val - src[0]) / (src[1]-src[0])) * (dst[1]-dst[0]) + dst[0]
-    if output < dst[0]: return int(dst[0])
-    if output > dst[1]: return int(dst[1])
-    return int(output)
-
-def correct_index(index, i, ci):
-    return ci[index+((i%8)*4)]
-
-def press_to_light(btn):
-    return  ( ( 24, 25, 26, 27, 28, 29, 30, 31 ),
-              ( 16, 17, 18, 19, 20, 21, 22, 23 ),
-              (  8,  9, 10, 11, 12, 13, 14, 15 ),
-              (  0,  1,  2,  3,  4,  5,  6,  7 ) )[btn[0]][btn[1]]
-
-def handle_axis(mode, axis, up_cc, down_cc, s, cc):
-    if   mode == b'd': s(cc(up_cc, scale(axis, (-10, 10), (0, 127))))
-    elif mode == b'f': s(cc(up_cc, scale(axis, (10, -10), (0, 127))))
+    output = (val - src[0]) * (dst[1]-dst[0]) // (src[1]-src[0]) + dst[0]
+    if output < dst[0]: return dst[0]
+    if output > dst[1]: return dst[1]
+    return output
+
+def key_index(btn): # position of a key in pressed_keys order
+    return btn[1] * surface.height + surface.height - 1 - btn[0]
+
+def combo_code(keys, start=0):
+    code = 0
+    r = range(start, len(keys))
+    for i in r: code = code * (len(surface.keys) + 1) + key_index(keys[i]) + 1
+    return code
+
+def find_combo(keys, combos, hold_combos):
+    if len(keys) <= 5:
+        handler = combos.get(combo_code(keys))
+        if handler: return handler
+    if len(keys) >= 2: return hold_combos.get(combo_code(keys, len(keys) - 2))
+
+def axis_value(mode, axis): # axis in 1/64 m/s^2, returns (0 for up_cc or 1 for down_cc, value)
+    if   mode == b'd': return (0, scale(axis, (-640, 640), (0, 127)))
+    elif mode == b'f': return (0, scale(axis, (640, -640), (0, 127)))
     elif mode == b's':
-        if axis > 0: s(cc(  up_cc, scale(axis, (0, 10), (0, 127))))
-        else:        s(cc(down_cc, scale(axis, (0, -10), (0, 127))))
+        if axis > 0: return (0, scale(axis, (0, 640), (0, 127)))
+        else:        return (1, scale(axis, (0, -640), (0, 127)))
     elif mode == b'o':
-        if axis > 0: s(cc(up_cc, 127))
-        else:        s(cc(up_cc, 0))
+        if axis > 0: return (0, 127)
+        else:        return (0, 0)
     elif mode == b'fo':
-        if axis > 0: s(cc(up_cc, 0))
-        else:        s(cc(up_cc, 127))
+        if axis > 0: return (0, 0)
+        else:        return (0, 127)
     elif mode == b'so':
         if axis > 0:
-            if axis > 5: s(cc(up_cc, 127))
-            else:        s(cc(up_cc, 0))
+            if axis > 320: return (0, 127)
+            else:          return (0, 0)
         else:    
-            if axis < -5: s(cc(down_cc, 127))
-            else:         s(cc(down_cc, 0))
-
-def handle_axes(modes, accel, ccs, cc, midi):    
-    handle_axis(modes[0], accel[1], ccs[0], ccs[1], midi.send, cc)
-    handle_axis(modes[1], accel[0], ccs[2], ccs[3], midi.send, cc)
-    handle_axis(modes[2], accel[2], ccs[4], ccs[5], midi.send, cc)
+            if axis < -320: return (1, 127)
+            else:           return (1, 0)
 
 def handle_cc_grid(cc_edit, modes, offset):
     for mode in modes:
-        if mode == b'd':  cc_edit.grid[1][offset].is_on = True
-        if mode == b'f':  cc_edit.grid[2][offset].is_on = True
-        if mode == b's':  cc_edit.grid[3][offset].is_on = True
-        if mode == b'o':  cc_edit.grid[4][offset].is_on = True
-        if mode == b'fo': cc_edit.grid[5][offset].is_on = True
-        if mode == b'so': cc_edit.grid[6][offset].is_on = True
-        if mode == None: cc_edit.grid[7][offset].is_on = True
+        if mode == b'd':  cc_edit.set(1, offset)
+        if mode == b'f':  cc_edit.set(2, offset)
+        if mode == b's':  cc_edit.set(3, offset)
+        if mode == b'o':  cc_edit.set(4, offset)
+        if mode == b'fo': cc_edit.set(5, offset)
+        if mode == b'so': cc_edit.set(6, offset)
+        if mode == None: cc_edit.set(7, offset)
         offset -= 1
 
 def handle_select_mode(pb):
@@ -119,7 +127,7 @@ def handle_select_mode(pb):
     else: return None
 
 def handle_cc_lights(pressed_buttons, cc_edit, row):
-    cc_edit.grid[pressed_buttons[0][1]][row].is_on = True
+    cc_edit.set(pressed_buttons[0][1], row)
 
 def increase_row_offset(row_offset, rows):
     new_offset = row_offset + 4
@@ -138,64 +146,291 @@ def decrease_column_offset(column_offset):
     return new_offset if new_offset >= 0 else column_offset
    
 def row_off(grid, row):   
-    for column in grid.grid:
-        column[row].is_on = False
-
-def shift_grid_left(grid):
-    for i in range(last_step + 1):
-        if i == last_step:
-            for j in range(len(grid.grid[0])):
-                grid.grid[i][j].is_on = grid.grid[0][j].is_on
-        else:
-            for j in range(len(grid.grid[0])):
-                grid.grid[i][j].is_on = grid.grid[i+1][j].is_on
-    return grid
+    for i in range(len(grid.on)):
+        grid.on[i] &= ~(1 << row)
 
-def shift_grid_right(grid):
-    for i in reversed(range(last_step + 1)):
-        if i == 0:
-            for j in range(len(grid.grid[0])):
-                grid.grid[i][j].is_on = grid.grid[last_step][j].is_on
-        else:
-            for j in range(len(grid.grid[0])):
-                grid.grid[i][j].is_on = grid.grid[i-1][j].is_on
+def stored_column(col, rot, lst_stp): # column holding step col of a pattern played rot steps ahead
+    return (col + rot) % lst_stp if rot and col < lst_stp else col
+
+def rotate_grid(grid, rot, lst_stp):
+    r = range(lst_stp)
+    bits = [ grid.bits((i + rot) % lst_stp) for i in r ]
+    accents = [ grid.accents((i + rot) % lst_stp) for i in r ]
+    for i in r: grid.set_column(i, bits[i], accents[i])
     return grid
 
-def write_save(notes, shift, last_step, axis_modes):
+def list_to_grid(cols, grid):
+    for col in range(min(len(cols), grid.columns)):
+        for row in range(min(len(cols[col]), len(grid.notes))):
+            grid.set(col, row, cols[col][row][0], cols[col][row][1])
+
+def checksum(buf, end):
+    a = b = 0
+    for i in range(end):
+        a = (a + buf[i]) % 255
+        b = (b + a) % 255
+    return b << 8 | a
+
+def read_word(buf, i):
+    return buf[i] | buf[i+1] << 8
+
+def write_word(buf, i, word):
+    buf[i] = word & 0xFF
+    buf[i+1] = word >> 8
+
+def encode_slot(buf, grids, lst_stp, ax_mds):
+    buf[0:2] = SLOT_MAGIC
+    buf[2] = SLOT_VERSION
+    buf[3] = len(grids[0].notes)
+    buf[4] = grids[0].columns
+    buf[5] = lst_stp
+    for i in range(3): buf[6+i] = AXIS_MODES.index(ax_mds[i])
+    buf[9] = len(grids)
+    i = SLOT_HEADER
+    for grid in grids:
+        buf[i:i + buf[3]] = grid.notes
+        buf[i + buf[3]:i + 2 * buf[3]] = grid.channels
+        i += 2 * buf[3]
+        blocks = []
+        for measure in grid.measures:
+            if measure not in blocks: blocks.append(measure) # shared measures are stored once
+        buf[i] = len(blocks)
+        i += 1
+        for measure in grid.measures:
+            buf[i] = blocks.index(measure)
+            i += 1
+        for measure in blocks:
+            for cols in (measure.on, measure.accent):
+                for bits in cols:
+                    write_word(buf, i, bits)
+                    i += 2
+    write_word(buf, i, checksum(buf, i))
+    return i + 2
+
+def decode_slot(buf, size, grids):
+    if size < SLOT_HEADER or buf[0:2] != SLOT_MAGIC: return None
+    rows, cols, count = buf[3], buf[4], buf[9]
+    if buf[2] == 1:
+        end = SLOT_HEADER + count * 4 * cols
+    elif buf[2] == 2 or buf[2] == SLOT_VERSION:
+        routing = 2 * rows if buf[2] == SLOT_VERSION else 0 # note and channel of every row
+        positions, end = (cols + 7) // 8, SLOT_HEADER
+        for g in range(count):
+            if end + routing >= size: return None
+            end += routing + 1 + positions + buf[end + routing] * 32
+    else:
+        return None
+    if size < end + 2 or checksum(buf, end) != read_word(buf, end): return None
+    i = SLOT_HEADER
+    for grid in grids[:count]:
+        mask = (1 << min(rows, len(grid.notes))) - 1
+        grid.clear()
+        if buf[2] == 1: # flat columns of on words then accent words
+            for col in range(min(cols, grid.columns)):
+                grid.set_column(col, read_word(buf, i + col * 2) & mask, read_word(buf, i + (cols + col) * 2) & mask)
+            i += 4 * cols
+            continue
+        for row in range(min(rows, len(grid.notes)) if routing else 0):
+            grid.route(row, buf[i + row] & 0x7F, buf[i + rows + row] & 0x0F)
+        i += routing
+        first = {} # block -> first position that holds it
+        for p in range(min(positions, len(grid.measures))):
+            block = buf[i + 1 + p]
+            if block in first:
+                grid.duplicate(first[block], p)
+                continue
+            first[block] = p
+            measure, start = grid.writable(p * 8), i + 1 + positions + block * 32
+            for col in range(8):
+                measure.on[col] = read_word(buf, start + col * 2) & mask
+                measure.accent[col] = read_word(buf, start + 16 + col * 2) & mask & measure.on[col]
+        i += 1 + positions + buf[i] * 32
+        grid.compile_all()
+    return [ buf[5] if buf[5] else 8, [ AXIS_MODES[buf[6+j]] for j in range(3) ] ]
+
+def cache_slot(slot, buf, size):
+    cache_image(slot, bytes(memoryview(buf)[:size]))
+
+def cache_image(slot, image):
+    if slot in slot_cache: cache_order.remove(slot)
+    elif len(cache_order) >= cache_size:
+        if not cache_size: return
+        del slot_cache[cache_order.pop(0)]
+    slot_cache[slot] = image
+    cache_order.append(slot)
+
+def uncache_slot(slot):
+    if slot in slot_cache:
+        del slot_cache[slot]
+        cache_order.remove(slot)
+
+def read_cached(curr_slt, nts, shft):
+    saved = slot_cache[curr_slt]
+    cache_order.remove(curr_slt)
+    cache_order.append(curr_slt)
+    return decode_slot(saved, len(saved), (nts, shft))
+
+def encode_measure(buf, grids, start, end):
+    i = 0
+    for grid in grids:
+        for col in range(start, start + 8):
+            write_word(buf, i, grid.bits(col) if col < end else 0)
+            write_word(buf, i + 16, grid.accents(col) if col < end else 0)
+            i += 2
+        i += 16
+    return i
+
+def decode_measure(buf, grids, start):
+    i = 0
+    for grid in grids:
+        mask = (1 << len(grid.notes)) - 1
+        for col in range(8):
+            grid.set_column(start + col, read_word(buf, i) & mask, read_word(buf, i + 16) & mask)
+            i += 2
+        i += 16
+
+def slot_clean(old, grids, lst_stp, ax_mds): # nothing to write when the grids are as they were loaded or saved
+    if old[5] != lst_stp or any(old[6+i] != AXIS_MODES.index(ax_mds[i]) for i in range(3)): return False
+    return not any(grid.is_dirty() for grid in grids)
+
+def slot_regions(buf, size, old, grids): # byte ranges of buf that differ from old, None when the layout moved
+    if len(old) != size or old[0:5] != buf[0:5] or old[9] != buf[9]: return None
+    rows, positions = buf[3], (buf[4] + 7) // 8
+    regions = [ (5, SLOT_HEADER) ] if old[5:SLOT_HEADER] != buf[5:SLOT_HEADER] else []
+    i = SLOT_HEADER
+    for grid in grids:
+        blocks = i + 2 * rows + 1 + positions
+        if old[i + 2 * rows:blocks] != buf[i + 2 * rows:blocks]: return None # measures shared differently
+        if grid.dirty[-1] and old[i:i + 2 * rows] != buf[i:i + 2 * rows]: regions.append((i, i + 2 * rows))
+        for p in range(positions):
+            start = blocks + buf[i + 2 * rows + 1 + p] * 32
+            if grid.dirty[p] and old[start:start + 32] != buf[start:start + 32] and (start, start + 32) not in regions:
+                regions.append((start, start + 32))
+        i = blocks + buf[i + 2 * rows] * 32
+    if regions: regions.append((size - 2, size))
+    return regions
+
+def recover_slot(curr_slt): # finish a save cut short once its log is complete, drop it otherwise
+    path = "/{}.jnl".format(curr_slt)
+    try: size = stat(path)[6]
+    except OSError: return
     try:
-        with open('{}.json'.format(current_slot), "w") as file:
-            file.write(dumps({
-                "notes": list(map(lambda x: list(map(lambda y: (y.is_on, y.is_accented), x)), notes.grid)),
-                "shift": list(map(lambda x: list(map(lambda y: (y.is_on, y.is_accented), x)), shift.grid)),
-                "last_step": last_step,
-                "axis_modes": axis_modes
-            }))
-    except MemoryError as e:
-        print(e)
+        with open(path, "rb") as log:
+            head = log.read(SAVE_LOG_HEADER)
+            table = log.read(4 * head[3]) if len(head) == SAVE_LOG_HEADER else b''
+            regions = [ (read_word(table, 4 * k), read_word(table, 4 * k + 2)) for k in range(len(table) // 4) ]
+            if head[0:2] == SAVE_LOG_MAGIC and size == SAVE_LOG_HEADER + len(table) + sum(end - start for start, end in regions) + 2:
+                log.seek(size - 2)
+                if log.read(2) == SAVE_LOG_COMMIT:
+                    log.seek(SAVE_LOG_HEADER + len(table))
+                    with open("/{}.bin".format(curr_slt), "wb" if head[2] else "r+b") as save:
+                        for start, end in regions:
+                            view = memoryview(slot_buffer)[:end - start]
+                            log.readinto(view)
+                            save.seek(start)
+                            save.write(view)
+        remove(path)
+    except OSError as e:
+        save_failed(e)
+
+def save_written(curr_slt):
+    slot_index[curr_slt] = 1
+    try: remove('/{}.json'.format(curr_slt)) # migrated to the binary format
+    except OSError: pass
+
+def save_failed(e):
+    global slots_stale
+    print(e)
+    slots_stale = True # the filesystem may be owned by the USB host
+
+def default_routing(grid):
+    r = range(len(grid.notes))
+    for row in r: grid.route(row, STARTING_NOTE + row, 0)
+
+def copy_routing(src, dst):
+    r = range(len(dst.notes))
+    for row in r: dst.route(row, src.notes[row], src.channels[row])
+    dst.compile_all()
+
+def handle_route_edit(grid, row, col, cols):
+    note, channel = grid.notes[row], grid.channels[row]
+    if   col == cols[0]: channel = (channel - 1) % 16
+    elif col == cols[1]: channel = (channel + 1) % 16
+    elif col == cols[2]: note = max(note - 1, 0)
+    elif col == cols[3]: note = min(note + 1, 127)
+    grid.route(row, note, channel)
+    grid.compile_all()
+    return note, channel
 
 def read_save(curr_slt, nts, shft):
+    for grid in (nts, shft): default_routing(grid)
+    if curr_slt in slot_cache:
+        saved = read_cached(curr_slt, nts, shft)
+        if saved:
+            for grid in (nts, shft): grid.clean()
+            return [ nts, shft, saved[0], saved[1] ]
+    recover_slot(curr_slt)
+    try:
+        with open("/{}.bin".format(curr_slt), "rb") as save:
+            size = save.readinto(slot_buffer)
+            saved = decode_slot(slot_buffer, size, (nts, shft))
+        if saved:
+            cache_slot(curr_slt, slot_buffer, size)
+            for grid in (nts, shft): grid.clean()
+            return [ nts, shft, saved[0], saved[1] ]
+    except OSError:
+        pass
+    saved = read_json_save(curr_slt, nts, shft)
+    for grid in (nts, shft): grid.compile_all() # steps play with the default routing set above
+    return saved
+
+def read_json_save(curr_slt, nts, shft):
     try:
         with open("/{}.json".format(curr_slt)) as save:
             pattern = loads(save.read())
+            clear_grid(nts) # legacy patterns are smaller than the grid
+            clear_grid(shft)
             if pattern["notes"]:
-                for column in range(len(pattern["notes"])):
-                    for note in range(len(pattern["notes"][0])):
-                        nts.grid[column][note].is_on = pattern["notes"][column][note][0]
-                        nts.grid[column][note].is_accented = pattern["notes"][column][note][1]
-                        shft.grid[column][note].is_on = pattern["shift"][column][note][0]
-                        shft.grid[column][note].is_accented = pattern["shift"][column][note][1]
+                list_to_grid(pattern["notes"], nts)
+                list_to_grid(pattern["shift"], shft)
             
             lst_stp = pattern["last_step"] if pattern["last_step"] else 8
             ax_mds = pattern["axis_modes"] if pattern["axis_modes"] else [ None, None, None ]
+            ax_mds = [ mode.encode() if isinstance(mode, str) else mode for mode in ax_mds ]
         return [ nts, shft, lst_stp, ax_mds ]
     except:
         return [ nts, shft, 8, [ None, None, None ] ]
         
+def sync_slots():
+    global slots_stale
+    r = range(len(slot_index))
+    for i in r: slot_index[i] = 0
+    try:
+        for f in listdir('/'):
+            name = f.split('.')
+            if len(name) == 2 and name[1] in ('bin', 'json') and name[0].isdigit() and int(name[0]) < len(slot_index):
+                slot_index[int(name[0])] = 1
+        slots_stale = False
+    except OSError as e:
+        print(e)
+
 def get_slots():
-    return list(map(lambda f: int(f.replace('.json', '')), [f for f in listdir() if f.endswith('.json')]))
+    if slots_stale: sync_slots()
+    return slot_index
+
+def delete_slot(slot):
+    global slots_stale
+    uncache_slot(slot)
+    for ext in ('bin', 'json', 'jnl'):
+        try: remove("/{}.{}".format(slot, ext))
+        except OSError as e:
+            if e.args[0] != ENOENT: slots_stale = True
+    slot_index[slot] = 0
 
 def light_slots(sts, clr, np):
-    for st in sts: np[st] = clr
+    r = range(min(len(sts), len(np)))
+    for st in r:
+        if sts[st]: np[st] = clr
     
 def handle_last_step_edit(lst_stp, pb, bts, cols):
     if pb == bts[0]: # Decrease by measure
@@ -214,26 +449,29 @@ def handle_last_step_edit(lst_stp, pb, bts, cols):
         if remainder == 0: return lst_stp + 8 if lst_stp + 8 < cols else lst_stp
         else: return lst_stp + (8-remainder)
 
+def handle_tempo_edit(bpm, pb, bts, tempi):
+    for bt, change in zip(bts, (-10, -1, 1, 10)):
+        if pb == bt: return max(tempi[0], min(bpm + change, tempi[1]))
+    return bpm
+
 def duplicate_measure(grids):
     for grid in grids:
-        for i, column in enumerate(grid):
-            if i >= 8:
-                for j, note in enumerate(column):
-                    note.is_on = grid[i-8][j].is_on
-                    note.is_accented = grid[i-8][j].is_accented
+        for i in range(1, len(grid.measures)): grid.duplicate(i - 1, i)
     return grids
 
 def fill_yes_no(conf_clr, dcln_clr, np):
-    r = range(32)
+    r = range(len(np))
     for i in r:
-        np[i] = conf_clr if i < 16 else dcln_clr
+        np[i] = conf_clr if i < len(np) // 2 else dcln_clr
 
 def delete_all_slots():
-    r = range(32)
+    slot_cache.clear()
+    del cache_order[:]
+    slots = get_slots()
+    r = range(len(slots))
     for i in r:
-        try: remove("/{}.json".format(i))
-        except OSError: pass
+        if slots[i]: delete_slot(i)
 
 def print_grid(grid):
-    print(list(map(lambda x: list(map(lambda y: y.index, x)), grid.grid)))
+    print(list(map(lambda x: '{:016b}'.format(grid.bits(x)), range(grid.columns))))
     
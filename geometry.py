@@ -0,0 +1,35 @@
+from constants import *
+
+"""
+======== Geometry ========
+"""
+
+class Geometry:
+    __slots__ = ["width", "height", "pixels", "keys", "cells"]
+    def __init__(self, boards):
+        places = sorted((board[0], board[1]) for board in boards)
+        if places != [ (0, y) for y in range(len(boards)) ] or len(boards) * BOARD_ROWS > NUMBER_OF_ROWS:
+            raise ValueError("BOARDS must stack up to {} boards in one column".format(NUMBER_OF_ROWS // BOARD_ROWS))
+        self.width = (max(board[0] for board in boards) + 1) * BOARD_COLUMNS
+        self.height = (max(board[1] for board in boards) + 1) * BOARD_ROWS
+        self.pixels = len(boards) * BOARD_COLUMNS * BOARD_ROWS
+        keys = bytearray(self.width * self.height) # key row * width + key column -> pixel
+        cells = bytearray(self.width * self.height) # visible column * height + visible row -> pixel
+        for b, (x, y, flipped) in enumerate(boards):
+            for row in range(BOARD_ROWS):
+                for col in range(BOARD_COLUMNS):
+                    if flipped: pixel = row * BOARD_COLUMNS + BOARD_COLUMNS - 1 - col
+                    else:       pixel = (BOARD_ROWS - 1 - row) * BOARD_COLUMNS + col
+                    pixel += b * BOARD_COLUMNS * BOARD_ROWS
+                    surface_row, surface_col = y * BOARD_ROWS + row, x * BOARD_COLUMNS + col
+                    keys[surface_row * self.width + surface_col] = pixel
+                    cells[surface_col * self.height + surface_row] = pixel
+        self.keys, self.cells = bytes(keys), bytes(cells)
+
+surface = Geometry(BOARDS)
+
+def cell_pixel(col, row): # pixel showing a grid cell, col is wrapped into the viewport
+    return surface.cells[col % surface.width * surface.height + row]
+
+def press_to_light(btn):
+    return surface.keys[btn[0] * surface.width + btn[1]]
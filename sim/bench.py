@@ -0,0 +1,103 @@
+"""
+Per-tick latency benchmark for code.py on a host.
+
+    python sim/bench.py [--ticks N] [--bpm BPM] [scenario ...]
+
+Each scenario runs twice: once for timing and once with tracemalloc to
+measure the bytes allocated while handling a clock.
+"""
+import argparse
+
+import hardware
+from hardware import Simulation
+
+"""
+Patterns
+"""
+def save_slot(root, functions, classes, slot, rows, last_step=16):
+    grids = tuple(classes.NoteGrid(functions.NUMBER_OF_COLUMNS, functions.NUMBER_OF_ROWS, functions.STARTING_NOTE) for _ in range(2))
+    for grid in grids:
+        for col in range(last_step):
+            for row in rows: grid.set(col, row, True, row % 2 == 0)
+    size = functions.encode_slot(functions.slot_buffer, grids, last_step, [ b'd', b's', b'so' ])
+    with open("{}/{}.bin".format(root, slot), "wb") as f: f.write(functions.slot_buffer[:size])
+
+def dense(root, functions, classes):
+    save_slot(root, functions, classes, 0, range(functions.NUMBER_OF_ROWS))
+
+def two_slots(root, functions, classes):
+    dense(root, functions, classes)
+    save_slot(root, functions, classes, 1, range(0, functions.NUMBER_OF_ROWS, 4), 8)
+
+def press(tick, keys, hold=2):
+    return [ (tick, keys), (tick + hold, []) ]
+
+def slot_switches(ticks):
+    from constants import SELECT_SLOT_MODE
+    keys = []
+    for i, tick in enumerate(range(24, ticks - 12, 48)):
+        keys += press(tick, SELECT_SLOT_MODE) + press(tick + 4, [ (3, i % 2) ])
+    return keys
+
+def chain(ticks):
+    from constants import CHAIN_MODE
+    return press(4, CHAIN_MODE) + press(8, [ (3, 0) ]) + press(12, [ (3, 1) ]) + press(16, [ (3, 1) ]) + press(20, [ (3, 7) ])
+
+def song(ticks):
+    from constants import SONG_MODE
+    return press(4, SONG_MODE) + press(150, [ (3, 2) ])
+
+def shift_mode(ticks):
+    from constants import SHIFT_MODE_COMBO
+    return press(4, SHIFT_MODE_COMBO)
+
+SCENARIOS = {
+    "empty":  (None, lambda ticks: []),
+    "dense":  (dense, lambda ticks: []),
+    "shift":  (dense, shift_mode),
+    "slots":  (two_slots, slot_switches),
+    "chain":  (two_slots, chain),
+    "song":   (dense, song),
+}
+
+"""
+Report
+"""
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+def us(seconds):
+    return "{:8.1f}".format(seconds * 1e6)
+
+def report(name, timing, allocation):
+    ticks = timing.clock_iterations
+    seconds = [ t[1] for t in ticks ]
+    delays = [ t[2] for t in ticks if t[2] is not None ]
+    allocated = [ t[4] for t in allocation.clock_iterations ]
+    late = sum(t[0] - 1 for t in ticks)
+    print("{}: {} ticks, {} late".format(name, sum(t[0] for t in ticks), late))
+    print("  tick loop  us   mean {} p50 {} p99 {} max {}".format(
+        us(sum(seconds) / max(len(seconds), 1)), us(percentile(seconds, .5)), us(percentile(seconds, .99)), us(max(seconds, default=0))))
+    print("  idle loop  us   mean {} max {} ({} loops)".format(
+        us(timing.idle_time / max(timing.idle_iterations, 1)), us(timing.idle_max), timing.idle_iterations))
+    print("  clock->out us   mean {} p99 {} max {}".format(
+        us(sum(delays) / max(len(delays), 1)), us(percentile(delays, .99)), us(max(delays, default=0))))
+    print("  midi out   B/tick {:6.1f}   alloc B/tick mean {:8.1f} max {:8d}".format(
+        sum(t[3] for t in ticks) / max(len(ticks), 1), sum(allocated) / max(len(allocated), 1), max(allocated, default=0)))
+    print("  leds       writes {} shows {}   accelerometer reads {}".format(timing.pixel_writes, timing.shows, timing.accelerometer_reads))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=384)
+    parser.add_argument("--bpm", type=float, default=120, help="0 sends the next clock as soon as the loop comes around")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS))
+    args = parser.parse_args()
+    for name in args.scenarios:
+        prepare, keys = SCENARIOS[name]
+        timing = Simulation(args.ticks, args.bpm, keys(args.ticks)).run(prepare)
+        allocation = Simulation(args.ticks, args.bpm, keys(args.ticks), trace_allocations=True).run(prepare)
+        report(name, timing, allocation)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+"""
+Host stand-in for the ADXL345 accelerometer.
+"""
+import hardware
+
+class ADXL345:
+    def __init__(self, i2c):
+        self.i2c = i2c
+
+    @property
+    def acceleration(self):
+        return hardware.sim.read_accelerometer()
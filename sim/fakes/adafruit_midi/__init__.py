@@ -0,0 +1,78 @@
+"""
+Host stand-in for adafruit_midi: parses and encodes the messages the
+sequencer uses over the fake usb_midi ports.
+"""
+import hardware
+
+class MIDIMessage:
+    _STATUS = 0x00
+    channel = None
+
+    def __bytes__(self):
+        return bytes((self._STATUS,))
+
+class MIDIUnknownEvent(MIDIMessage):
+    def __init__(self, status):
+        self.status = status
+
+def _channel_message(status, data, channel):
+    from adafruit_midi.note_on import NoteOn
+    from adafruit_midi.note_off import NoteOff
+    from adafruit_midi.control_change import ControlChange
+    kind = { 0x90: NoteOn, 0x80: NoteOff, 0xB0: ControlChange }[status]
+    return kind(data[0], data[1], channel=channel)
+
+class MIDI:
+    def __init__(self, midi_in=None, midi_out=None, *, in_channel=None, out_channel=0, in_buf_size=30):
+        self._midi_in = midi_in
+        self._midi_out = midi_out
+        self.in_channel = in_channel
+        self.out_channel = out_channel
+        self._in_buf_size = in_buf_size
+        self._in_buf = bytearray()
+        self._running_status = None
+
+    def receive(self):
+        return hardware.sim.received(self._receive())
+
+    def _receive(self):
+        from adafruit_midi.timing_clock import TimingClock
+        from adafruit_midi.start import Start
+        from adafruit_midi.stop import Stop
+        self._in_buf.extend(self._midi_in.read(self._in_buf_size))
+        while self._in_buf:
+            status = self._in_buf[0]
+            if status >= 0xF8:
+                del self._in_buf[0]
+                kind = { 0xF8: TimingClock, 0xFA: Start, 0xFC: Stop }.get(status)
+                return kind() if kind else MIDIUnknownEvent(status)
+            if status == 0xF0:
+                from adafruit_midi.system_exclusive import SystemExclusive
+                end = self._in_buf.find(0xF7)
+                if end < 0: return None
+                message = SystemExclusive(self._in_buf[1:2], self._in_buf[2:end])
+                del self._in_buf[:end + 1]
+                self._running_status = None
+                return message
+            if status & 0x80:
+                self._running_status = status
+                del self._in_buf[0]
+                continue
+            if self._running_status is None or len(self._in_buf) < 2:
+                if self._running_status is None: del self._in_buf[0]
+                return None
+            data = self._in_buf[:2]
+            del self._in_buf[:2]
+            if self._running_status & 0xF0 in (0x80, 0x90, 0xB0):
+                return _channel_message(self._running_status & 0xF0, data, self._running_status & 0x0F)
+            return MIDIUnknownEvent(self._running_status)
+        return None
+
+    def send(self, msg, channel=None):
+        if channel is None: channel = self.out_channel
+        msgs = msg if isinstance(msg, (list, tuple)) else (msg,)
+        data = bytearray()
+        for m in msgs:
+            m.channel = channel
+            data.extend(bytes(m))
+        self._midi_out.write(data, len(data))
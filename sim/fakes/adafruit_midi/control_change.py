@@ -0,0 +1,11 @@
+from adafruit_midi import MIDIMessage
+
+class ControlChange(MIDIMessage):
+    _STATUS = 0xB0
+    def __init__(self, control, value, *, channel=None):
+        self.control = control
+        self.value = value
+        self.channel = channel
+
+    def __bytes__(self):
+        return bytes((self._STATUS | (self.channel or 0), self.control, self.value))
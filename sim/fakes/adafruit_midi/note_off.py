@@ -0,0 +1,11 @@
+from adafruit_midi import MIDIMessage
+
+class NoteOff(MIDIMessage):
+    _STATUS = 0x80
+    def __init__(self, note, velocity=0, *, channel=None):
+        self.note = note
+        self.velocity = velocity
+        self.channel = channel
+
+    def __bytes__(self):
+        return bytes((self._STATUS | (self.channel or 0), self.note, self.velocity))
@@ -0,0 +1,4 @@
+from adafruit_midi import MIDIMessage
+
+class Start(MIDIMessage):
+    _STATUS = 0xFA
@@ -0,0 +1,4 @@
+from adafruit_midi import MIDIMessage
+
+class Stop(MIDIMessage):
+    _STATUS = 0xFC
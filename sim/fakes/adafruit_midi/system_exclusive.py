@@ -0,0 +1,10 @@
+from adafruit_midi import MIDIMessage
+
+class SystemExclusive(MIDIMessage):
+    _STATUS = 0xF0
+    def __init__(self, manufacturer_id, data):
+        self.manufacturer_id = bytes(manufacturer_id)
+        self.data = bytes(data)
+
+    def __bytes__(self):
+        return bytes((self._STATUS,)) + self.manufacturer_id + self.data + b'\xf7'
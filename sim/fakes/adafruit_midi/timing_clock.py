@@ -0,0 +1,4 @@
+from adafruit_midi import MIDIMessage
+
+class TimingClock(MIDIMessage):
+    _STATUS = 0xF8
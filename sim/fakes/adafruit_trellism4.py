@@ -0,0 +1,43 @@
+"""
+Host stand-in for the Trellis M4: a recording NeoPixel strip and scripted keys.
+"""
+import hardware
+
+class NeoPixel:
+    def __init__(self, n):
+        self.pixels = [(0, 0, 0)] * n
+        self.auto_write = True
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def __setitem__(self, index, color):
+        self.pixels[index] = color
+        hardware.sim.pixel_writes += 1
+        if self.auto_write: self.show()
+
+    def fill(self, color):
+        for i in range(len(self.pixels)): self.pixels[i] = color
+        if self.auto_write: self.show()
+
+    def show(self):
+        hardware.sim.shows += 1
+
+class _NeoPixelArray:
+    def __init__(self, neopixel):
+        self._neopixel = neopixel
+
+    def fill(self, color):
+        self._neopixel.fill(color)
+
+class TrellisM4Express:
+    def __init__(self, rotation=0):
+        self.rotation = rotation
+        self.pixels = _NeoPixelArray(NeoPixel(32))
+
+    @property
+    def pressed_keys(self):
+        return hardware.sim.read_keys()
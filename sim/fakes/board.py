@@ -0,0 +1,7 @@
+"""
+Host stand-in for the Trellis M4 board pins.
+"""
+
+ACCELEROMETER_SCL = "ACCELEROMETER_SCL"
+ACCELEROMETER_SDA = "ACCELEROMETER_SDA"
+NEOPIXEL          = "NEOPIXEL"
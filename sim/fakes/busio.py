@@ -0,0 +1,8 @@
+"""
+Host stand-in for busio.
+"""
+
+class I2C:
+    def __init__(self, scl, sda):
+        self.scl = scl
+        self.sda = sda
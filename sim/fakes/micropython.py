@@ -0,0 +1,6 @@
+"""
+Host stand-in for the micropython module.
+"""
+
+def const(value):
+    return value
@@ -0,0 +1,9 @@
+"""
+Host stand-in for supervisor.
+"""
+import time
+
+_start = time.perf_counter()
+
+def ticks_ms():
+    return int((time.perf_counter() - _start) * 1000) & ((1 << 29) - 1)
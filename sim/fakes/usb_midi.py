@@ -0,0 +1,15 @@
+"""
+Host stand-in for usb_midi, wired to the scripted clock in hardware.
+"""
+import hardware
+
+class PortIn:
+    def read(self, nbytes):
+        return hardware.sim.read_midi(nbytes)
+
+class PortOut:
+    def write(self, buf, nbytes=None):
+        hardware.sim.write_midi(bytes(buf if nbytes is None else buf[:nbytes]))
+        return len(buf) if nbytes is None else nbytes
+
+ports = (PortIn(), PortOut())
@@ -0,0 +1,170 @@
+"""
+Scripted hardware for running code.py on a host.
+
+The stand-in modules in sim/fakes read keys, accelerometer values and
+MIDI input from the active Simulation and report LED and MIDI output
+back to it. A main loop iteration starts at the first receive() after
+one that returned None, which is where the Simulation feeds the next
+clock and takes its measurements.
+"""
+import builtins
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from math import sin, cos
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+for path in (REPO, os.path.join(HERE, "fakes"), HERE):
+    if path not in sys.path: sys.path.insert(0, path)
+
+from micropython import const
+builtins.const = const # constants.py relies on the compiler knowing const
+
+sim = None
+
+class Done(BaseException):
+    pass
+
+class Simulation:
+    def __init__(self, ticks, bpm=120, keys=(), trace_allocations=False):
+        self.ticks = ticks # clocks to send between Start and Stop
+        self.interval = 60 / (bpm * 24) if bpm else 0
+        self.keys = sorted(keys, key=lambda k: k[0]) # (tick, pressed keys)
+        self.trace_allocations = trace_allocations
+        self.pending = bytearray()
+        self.sent = 0
+        self.start_time = None
+        self.stopped = False
+        self.done = False
+        self.idle = True
+        self.iteration_start = None
+        self.iteration_clocks = 0
+        self.iteration_base = 0
+        self.first_write = None
+        self.written = 0
+        self.clock_iterations = [] # (clocks, seconds, first output delay, bytes out, bytes allocated)
+        self.idle_iterations = 0
+        self.idle_time = 0.0
+        self.idle_max = 0.0
+        self.pixel_writes = 0
+        self.shows = 0
+        self.accelerometer_reads = 0
+        self.globals = None
+
+    """
+    Scripted Input
+    """
+    def read_midi(self, nbytes):
+        if self.idle:
+            self.idle = False
+            self.next_iteration(time.perf_counter())
+        data = bytes(self.pending[:nbytes])
+        del self.pending[:nbytes]
+        return data
+
+    def received(self, message):
+        if message is None: self.idle = True
+        return message
+
+    def read_keys(self):
+        keys = []
+        for tick, pressed in self.keys:
+            if tick > self.sent: break
+            keys = pressed
+        return list(keys)
+
+    def read_accelerometer(self):
+        self.accelerometer_reads += 1
+        t = time.perf_counter()
+        return (8 * sin(t), 8 * cos(t), 9.8)
+
+    """
+    Recorded Output
+    """
+    def write_midi(self, data):
+        if self.first_write is None: self.first_write = time.perf_counter()
+        self.written += len(data)
+
+    """
+    Loop Boundaries
+    """
+    def next_iteration(self, now):
+        if self.iteration_start is not None: self.record(now)
+        if self.done: raise Done()
+        self.iteration_start = now
+        self.iteration_clocks = 0
+        self.first_write = None
+        self.written = 0
+        if self.start_time is None:
+            self.start_time = now
+            self.pending.append(0xFA)
+        elif self.sent < self.ticks:
+            while self.sent < self.ticks and now >= self.start_time + self.sent * self.interval:
+                self.pending.append(0xF8)
+                self.iteration_clocks += 1
+                self.sent += 1
+                if not self.interval: break
+        elif not self.stopped:
+            self.pending.append(0xFC)
+            self.stopped = True
+        else:
+            self.done = True
+
+    def record(self, now):
+        seconds = now - self.iteration_start
+        allocated = 0
+        if self.trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            allocated = peak - self.iteration_base
+            tracemalloc.reset_peak()
+            self.iteration_base = current
+        if self.iteration_clocks:
+            delay = self.first_write - self.iteration_start if self.first_write is not None else None
+            self.clock_iterations.append((self.iteration_clocks, seconds, delay, self.written, allocated))
+        else:
+            self.idle_iterations += 1
+            self.idle_time += seconds
+            self.idle_max = max(self.idle_max, seconds)
+
+    """
+    Running code.py
+    """
+    def run(self, prepare=None):
+        global sim
+        sim = self
+        for name in ("constants", "geometry", "functions", "classes"): sys.modules.pop(name, None)
+        root = tempfile.mkdtemp(prefix="drum-sequencer-")
+        try:
+            import functions
+            import classes
+            mount(root, (functions, classes))
+            if prepare: prepare(root, functions, classes)
+            path = os.path.join(REPO, "code.py")
+            with open(path) as f: source = compile(f.read(), path, "exec")
+            self.globals = { "__name__": "__main__" }
+            if self.trace_allocations: tracemalloc.start()
+            try: exec(source, self.globals)
+            except Done: pass
+            finally:
+                if self.trace_allocations: tracemalloc.stop()
+        finally:
+            shutil.rmtree(root)
+            sim = None
+        return self
+
+def mount(root, modules):
+    """Point the absolute slot paths used on the device at a host directory."""
+    def host(path): return os.path.join(root, path.lstrip("/"))
+    def sim_open(path, *args, **kwargs): return open(host(path), *args, **kwargs)
+    def sim_listdir(path="/"): return os.listdir(host(path))
+    def sim_remove(path): os.remove(host(path))
+    def sim_stat(path): return os.stat(host(path))
+    for module in modules:
+        module.open = sim_open
+        module.listdir = sim_listdir
+        module.remove = sim_remove
+        module.stat = sim_stat